@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# Imports
+import csv
+import io
+
+import database
+from aircraft_validation import validate_aircraft_id, validate_aircraft_fields
+
+#  Bulk aircraft import from CSV
+##     import_aircraft_csv(textstream, report)   -> {'read', 'loaded', 'rejected'}
+##     REPORT_COLUMNS
+
+
+# Header names we accept (case-insensitive): the form field names and the column names
+COLUMN_ALIASES = {
+    'aircraftid': 'aircraftid',
+    'icaocode': 'icaocode',
+    'aircraftregistration': 'aircraftregistration',
+    'registration': 'aircraftregistration',
+    'manufacturer': 'manufacturer',
+    'model': 'model',
+    'capacity': 'capacity',
+}
+REQUIRED_COLUMNS = ['aircraftid', 'icaocode', 'aircraftregistration', 'manufacturer', 'model', 'capacity']
+
+# One line of the rejection report per rejected CSV row
+REPORT_COLUMNS = ['line', 'aircraftid', 'errors']
+
+# Rows per chunk handed to COPY
+COPY_CHUNK_ROWS = 1000
+
+# Aircraft ids are below 10^6, so one byte per id spots repeats within the
+# file in constant memory
+MAX_AIRCRAFT_ID = 10**6
+
+
+class ImportFileError(Exception):
+    """ The CSV file itself is unusable (bad header, bad encoding, ...)."""
+
+
+################################################################################
+# CSV import
+#   - Reads the CSV one row at a time and checks every row with the same rules
+#     as the /add_aircraft form
+#   - Valid rows are streamed straight into PostgreSQL COPY in chunks, so
+#     memory stays the same whatever the file size
+#   - Rejected rows (bad values, repeated ids, ids already in the database)
+#     are written to report as CSV with the reason
+#   - All valid rows are loaded in one transaction, or none are
+################################################################################
+
+def import_aircraft_csv(textstream, report):
+    reader = csv.reader(textstream)
+    try:
+        header = next(reader)
+    except StopIteration:
+        raise ImportFileError("The CSV file is empty.")
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ImportFileError(f"Could not read the CSV header: {e}")
+
+    positions = {}
+    for i, name in enumerate(header):
+        column = COLUMN_ALIASES.get(name.strip().lower())
+        if column is not None:
+            positions[column] = i
+    missing = [c for c in REQUIRED_COLUMNS if c not in positions]
+    if missing:
+        raise ImportFileError(f"The CSV file is missing the column(s): {', '.join(missing)}")
+
+    writer = csv.writer(report)
+    writer.writerow(REPORT_COLUMNS)
+    counts = {'read': 0, 'loaded': 0, 'rejected': 0}
+    seen = bytearray(MAX_AIRCRAFT_ID)
+    problems = []
+
+    def reject(line, aircraftid, errors):
+        counts['rejected'] += 1
+        writer.writerow([line, aircraftid, '; '.join(errors)])
+
+    def valid_rows():
+        # A generator that raised mid-COPY would leave the connection
+        # unusable, so stop quietly and report the problem afterwards
+        try:
+            for row in reader:
+                if not any(field.strip() for field in row):
+                    continue
+                counts['read'] += 1
+                line = reader.line_num
+                values = {c: (row[i].strip() if i < len(row) else '') for c, i in positions.items()}
+
+                errors = []
+                aircraftid = validate_aircraft_id(values['aircraftid'], errors)
+                capacity = validate_aircraft_fields(values['icaocode'], values['aircraftregistration'],
+                                                    values['manufacturer'], values['model'],
+                                                    values['capacity'], errors)
+                if not errors and aircraftid >= 0:
+                    if seen[aircraftid]:
+                        errors.append(f"Aircraft ID {aircraftid} appears more than once in the file.")
+                    seen[aircraftid] = 1
+                elif not errors:
+                    errors.append("Aircraft ID must not be negative.")
+
+                if errors:
+                    reject(line, values['aircraftid'], errors)
+                    continue
+
+                yield (line, aircraftid, values['icaocode'], values['aircraftregistration'],
+                       values['manufacturer'], values['model'], capacity)
+        except (csv.Error, UnicodeDecodeError) as e:
+            problems.append(f"Could not read line {reader.line_num + 1}: {e}")
+
+    def existing(line, aircraftid):
+        reject(line, aircraftid, [f"Aircraft ID {aircraftid} already exists in the database."])
+
+    def check_file_read():
+        # Raising here rolls back everything COPY loaded
+        if problems:
+            raise ImportFileError(problems[0])
+
+    loaded = database.bulk_load_aircraft(_csv_chunks(valid_rows()), existing, after_copy=check_file_read)
+    if loaded is None:
+        raise ConnectionError("Could not connect to the database, check config.ini")
+
+    counts['loaded'] = loaded
+    return counts
+
+
+def _csv_chunks(rows):
+    """ Groups rows into CSV text chunks for COPY ... FROM STDIN."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending == COPY_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue()
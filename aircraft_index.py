@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# Imports
+import bisect
+import logging
+import threading
+import time
+
+import database
+from app_config import get_config
+
+#  In-memory prefix index over aircraft, for autocomplete
+##     AircraftIndex(max_age)
+##         .build(rows)
+##         .upsert(row)
+##         .remove(aircraft_id)
+##         .search(text, limit)   -> list of dicts
+##         .stats()
+##     get_aircraft_index()
+##     start_background_build()
+
+# Columns that can be searched, and the columns each result carries
+SEARCH_FIELDS = ['aircraftregistration', 'icaocode', 'manufacturer', 'model']
+RESULT_FIELDS = ['aircraftid'] + SEARCH_FIELDS
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+
+def normalize(text):
+    """ Lower case with punctuation and spaces removed, so 'vha' finds 'VH-ABC'."""
+    return ''.join(ch for ch in str(text).lower() if ch.isalnum())
+
+
+def index_keys(row):
+    """ Yields (key, field) for every prefix-searchable key of an aircraft row:
+        each search field as a whole, and each word of it on its own."""
+    for field in SEARCH_FIELDS:
+        value = row.get(field)
+        if not value:
+            continue
+        keys = {normalize(value)}
+        keys.update(normalize(word) for word in str(value).split())
+        for key in keys:
+            if key:
+                yield key, field
+
+
+################################################################################
+# Aircraft prefix index
+#   - One sorted list of (key, aircraftid, field) tuples; a prefix search is a
+#     bisect to the first key >= prefix and a walk forward while keys still
+#     start with it, so lookups never touch Postgres
+#   - Kept in sync by database.on_aircraft_change, which fires after each
+#     committed add/update/delete; a bulk import marks the index stale
+#   - Other processes' writes are picked up by rebuilding in the background
+#     once the index is older than max_age seconds
+################################################################################
+
+class AircraftIndex:
+
+    def __init__(self, max_age=300.0):
+        self.max_age = max_age
+        self._entries = []
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._stale = True
+        self._building = False
+        # Changes that arrive while a rebuild is reading the table
+        self._replay = []
+
+    def build(self, rows):
+        """ Replace the whole index with rows (dict-like aircraft rows)."""
+        entries = []
+        by_id = {}
+        for row in rows:
+            row = {f: row[f] for f in RESULT_FIELDS}
+            by_id[row['aircraftid']] = row
+            entries.extend((key, row['aircraftid'], field) for key, field in index_keys(row))
+        entries.sort()
+
+        with self._lock:
+            self._entries = entries
+            self._rows = by_id
+            self._built_at = time.monotonic()
+            self._stale = False
+            replay, self._replay = self._replay, []
+            for change in replay:
+                self._apply(*change)
+
+    def upsert(self, row):
+        with self._lock:
+            self._apply(row['aircraftid'], {f: row.get(f) for f in RESULT_FIELDS})
+
+    def remove(self, aircraft_id):
+        with self._lock:
+            self._apply(aircraft_id, None)
+
+    def mark_stale(self):
+        with self._lock:
+            self._stale = True
+
+    def search(self, text, limit=DEFAULT_LIMIT):
+        """ Up to limit aircraft with a key starting with text, each once."""
+        prefix = normalize(text)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        with self._lock:
+            entries = self._entries
+            i = bisect.bisect_left(entries, (prefix,))
+            while i < len(entries) and len(results) < limit:
+                key, aircraft_id, field = entries[i]
+                if not key.startswith(prefix):
+                    break
+                if aircraft_id not in seen:
+                    seen.add(aircraft_id)
+                    results.append(dict(self._rows[aircraft_id], matched=field))
+                i += 1
+        return results
+
+    def needs_build(self):
+        with self._lock:
+            if self._building:
+                return False
+            return (self._stale or self._built_at is None
+                    or time.monotonic() - self._built_at > self.max_age)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'aircraft': len(self._rows),
+                'keys': len(self._entries),
+                'age': time.monotonic() - self._built_at if self._built_at is not None else None,
+                'stale': self._stale,
+            }
+
+    ######################################
+    # Internal helpers (caller holds the lock)
+    ######################################
+
+    def _apply(self, aircraft_id, row):
+        if self._building:
+            self._replay.append((aircraft_id, row))
+
+        old = self._rows.pop(aircraft_id, None)
+        if old is not None:
+            for key, field in index_keys(old):
+                i = bisect.bisect_left(self._entries, (key, aircraft_id, field))
+                if i < len(self._entries) and self._entries[i] == (key, aircraft_id, field):
+                    del self._entries[i]
+
+        if row is not None:
+            self._rows[aircraft_id] = row
+            for key, field in index_keys(row):
+                bisect.insort(self._entries, (key, aircraft_id, field))
+
+
+# The process-wide index, built from list_aircraft()
+_index = AircraftIndex(max_age=get_config().getfloat('CACHE', 'aircraft_index_max_age', fallback=300.0))
+
+def get_aircraft_index():
+    """ The index, with a rebuild started in the background if it is stale."""
+    if _index.needs_build():
+        start_background_build()
+    return _index
+
+def start_background_build():
+    with _index._lock:
+        if _index._building:
+            return
+        _index._building = True
+    threading.Thread(target=_rebuild, name="aircraft-index-build", daemon=True).start()
+
+def _rebuild():
+    try:
+        rows = database.list_aircraft()
+        if rows is None:
+            logging.error("Could not build the aircraft index, will retry on the next lookup")
+            return
+        _index.build(rows)
+    finally:
+        with _index._lock:
+            _index._building = False
+            _index._replay = []
+
+@database.on_aircraft_change
+def _sync_index(aircraft_id, row):
+    if aircraft_id is None:
+        _index.mark_stale()
+    elif row is None:
+        _index.remove(aircraft_id)
+    else:
+        _index.upsert(row)
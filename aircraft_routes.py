@@ -1,14 +1,35 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file, jsonify
 import database
-import re
+import aircraft_index
+import io
+import tempfile
+from pagination import page_args, keyset_page
+from streaming import wants_stream, stream_page
+from table_export import export_response
+from http_caching import conditional_get
+from page_cache import cached_page
+from query_budget import query_budget
+from aircraft_validation import validate_aircraft_id, validate_aircraft_fields
+from aircraft_import import import_aircraft_csv
 aircraft_bp = Blueprint('aircraft', __name__)
 
+# Build the autocomplete index in the background as soon as the app starts
+@aircraft_bp.record_once
+def build_aircraft_index(state):
+    aircraft_index.start_background_build()
+
 
 @aircraft_bp.route('/aircrafts')
+@conditional_get('aircraft')
+@query_budget(2)
 def list_aircrafts():
-    print(session)
+    # Admins can ask for every aircraft, streamed as it is read
+    if wants_stream():
+        return stream_page('list_aircrafts.html', aircrafts=database.stream_aircraft(), pager=None, session=session, page={'title': 'Aircraft List'})
 
-    aircrafts = database.list_aircraft()
+    # Fetch one keyset page of aircraft
+    after, before, limit = page_args(int)
+    aircrafts, pager = keyset_page(database.list_aircraft, 'aircraftid', after, before, limit)
     
     # Handle empty aircraft list
     if not aircrafts:
@@ -16,9 +37,26 @@ def list_aircrafts():
         flash('No aircrafts found', 'danger')
         
     # Return the template with session and page variables
-    return render_template('list_aircrafts.html', aircrafts=aircrafts, session=session, page={'title': 'Aircraft List'})
+    return render_template('list_aircrafts.html', aircrafts=aircrafts, pager=pager, session=session, page={'title': 'Aircraft List'})
+
+@aircraft_bp.route('/aircrafts/autocomplete')
+def autocomplete_aircrafts():
+    # Prefix search over registration, ICAO code, manufacturer and model,
+    # answered from the in-memory index without a database query
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', aircraft_index.DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, aircraft_index.MAX_LIMIT))
+    results = aircraft_index.get_aircraft_index().search(query, limit)
+    return jsonify({'query': query, 'results': results})
+
+@aircraft_bp.route('/aircrafts/export.<fmt>')
+def export_aircrafts(fmt):
+    # Stream every aircraft as CSV or NDJSON straight from the database
+    return export_response('aircraft', fmt)
 
 @aircraft_bp.route('/aircraft/<int:aircraft_id>')
+@conditional_get('aircraft')
+@query_budget(2)
 def view_aircraft(aircraft_id):
     aircraft = database.get_aircraft_by_id(aircraft_id)
     
@@ -33,6 +71,7 @@ def view_aircraft(aircraft_id):
 
 
 @aircraft_bp.route('/add_aircraft', methods=['GET', 'POST'])
+@query_budget(2)
 def add_aircraft():
     if request.method == 'POST':
         aircraft_id = request.form['AircraftID']
@@ -44,36 +83,8 @@ def add_aircraft():
 
         # Input Validation
         errors = []
-
-        # Check if aircraft_id is a valid integer and less than 10^6
-        try:
-            aircraft_id = int(aircraft_id)
-            if aircraft_id >= 10**6:
-                errors.append("Aircraft ID should be less than 1,000,000.")
-        except ValueError:
-            errors.append("Aircraft ID must be a valid integer.")
-
-        # Validate ICAO Code format (starts with a letter and ends with 3 digits)
-        if not re.match(r'^[A-Za-z]\d{3}$', icao_code):
-            errors.append("ICAO Code must start with a letter and end with 3 digits (e.g., 'D123').")
-
-        # Validate Registration format (e.g., XX-YYY or XX-Y12)
-        if not re.match(r'^[A-Za-z]{2}-[A-Za-z0-9]{3}$', registration):
-            errors.append("Registration must follow the format 'XX-YYY' or 'XX-Y12'.")
-
-        # Check if manufacturer or model exceeds 100 characters
-        if len(manufacturer) > 100:
-            errors.append("Manufacturer cannot exceed 100 characters.")
-        if len(model) > 100:
-            errors.append("Model cannot exceed 100 characters.")
-
-        # Check if capacity is a valid integer
-        try:
-            capacity = int(capacity)
-            if capacity <= 0:
-                errors.append("Capacity must be a positive integer.")
-        except ValueError:
-            errors.append("Capacity must be a valid integer.")
+        aircraft_id = validate_aircraft_id(aircraft_id, errors)
+        capacity = validate_aircraft_fields(icao_code, registration, manufacturer, model, capacity, errors)
 
         # Check if the aircraft ID is already in the database
         existing_aircraft = database.get_aircraft_by_id(aircraft_id)
@@ -100,6 +111,7 @@ def add_aircraft():
 
 
 @aircraft_bp.route('/update_aircraft/<int:aircraft_id>', methods=['GET', 'POST'])
+@query_budget(2)
 def update_aircraft(aircraft_id):
     aircraft = database.get_aircraft_by_id(aircraft_id)
     
@@ -118,28 +130,7 @@ def update_aircraft(aircraft_id):
 
         # Input Validation
         errors = []
-
-        # Validate ICAO Code format (starts with a letter and ends with 3 digits)
-        if not re.match(r'^[A-Za-z]\d{3}$', icao_code):
-            errors.append("ICAO Code must start with a letter and end with 3 digits (e.g., 'D123').")
-
-        # Validate Registration format (e.g., XX-YYY or XX-Y12)
-        if not re.match(r'^[A-Za-z]{2}-[A-Za-z0-9]{3}$', registration):
-            errors.append("Registration must follow the format 'XX-YYY' or 'XX-Y12'.")
-
-        if len(manufacturer) > 100:
-            errors.append("Manufacturer cannot exceed 100 characters.")
-        
-        if len(model) > 100:
-            errors.append("Model cannot exceed 100 characters.")
-
-        # Validate capacity as a positive integer
-        try:
-            capacity = int(capacity)
-            if capacity <= 0:
-                errors.append("Capacity must be a positive integer.")
-        except ValueError:
-            errors.append("Capacity must be a valid integer.")
+        capacity = validate_aircraft_fields(icao_code, registration, manufacturer, model, capacity, errors)
 
         # If there are validation errors, flash them and return to form
         if errors:
@@ -160,13 +151,54 @@ def update_aircraft(aircraft_id):
 
 
 @aircraft_bp.route('/delete_aircraft/<int:aircraft_id>', methods=['POST'])
+@query_budget(1)
 def delete_aircraft(aircraft_id):
     # Delete aircraft from the database
     database.delete_aircraft(aircraft_id)
     flash(f'Aircraft with ID {aircraft_id} has been deleted.')
     return redirect(url_for('aircraft.list_aircrafts'))
 
+@aircraft_bp.route('/aircrafts/import', methods=['GET', 'POST'])
+def import_aircrafts():
+    # Only admins may bulk load aircraft
+    if not session.get('isadmin'):
+        flash('Only admins can import aircraft.', 'error')
+        return redirect(url_for('aircraft.list_aircrafts'))
+
+    if request.method == 'POST':
+        upload = request.files.get('csvfile')
+        if upload is None or upload.filename == '':
+            flash('Please choose a CSV file to import.', 'error')
+            return render_template('import_aircraft.html', session=session, page={'title': 'Import Aircraft'})
+
+        # Werkzeug keeps large uploads on disk, and the rejection report goes to
+        # a spooled temporary file, so neither is held in memory
+        report = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        report_text = io.TextIOWrapper(report, encoding='utf-8', newline='', write_through=True)
+        try:
+            counts = import_aircraft_csv(io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline=''), report_text)
+        except Exception as e:
+            flash(f'Error importing aircraft: {str(e)}', 'error')
+            return render_template('import_aircraft.html', session=session, page={'title': 'Import Aircraft'})
+        report_text.detach()
+
+        flash(f"Imported {counts['loaded']} aircraft, rejected {counts['rejected']} of {counts['read']} rows.", 'success')
+        if counts['rejected'] == 0:
+            return redirect(url_for('aircraft.list_aircrafts'))
+
+        # Hand back the rejection report so the rows can be fixed and re-sent
+        report.seek(0)
+        response = send_file(report, mimetype='text/csv', as_attachment=True,
+                             download_name='aircraft_import_rejections.csv')
+        response.headers['X-Import-Loaded'] = str(counts['loaded'])
+        response.headers['X-Import-Rejected'] = str(counts['rejected'])
+        return response
+
+    return render_template('import_aircraft.html', session=session, page={'title': 'Import Aircraft'})
+
+
 @aircraft_bp.route('/aircraft_summary')
+@cached_page('aircraft')
 def aircraft_summary():
     summary = database.aircraft_summary()
     
@@ -178,6 +210,7 @@ def aircraft_summary():
 
 
 @aircraft_bp.route('/search_aircraft_by_id', methods=['GET', 'POST'])
+@query_budget(1)
 def search_aircraft_by_id():
     if request.method == 'POST':
         # Get the aircraft ID from the form
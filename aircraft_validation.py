@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# Imports
+import re
+
+#  Aircraft field validation, shared by the add/update forms and the bulk CSV import
+##     validate_aircraft_id(aircraft_id, errors)   -> int, or the value as given
+##     validate_aircraft_fields(icao_code, registration, manufacturer, model, capacity, errors)
+##         -> capacity as an int
+#  Each appends a message to errors for every problem it finds
+
+
+def validate_aircraft_id(aircraft_id, errors):
+    # Check if aircraft_id is a valid integer and less than 10^6
+    try:
+        aircraft_id = int(aircraft_id)
+        if aircraft_id >= 10**6:
+            errors.append("Aircraft ID should be less than 1,000,000.")
+    except (TypeError, ValueError):
+        errors.append("Aircraft ID must be a valid integer.")
+    return aircraft_id
+
+def validate_aircraft_fields(icao_code, registration, manufacturer, model, capacity, errors):
+    # Validate ICAO Code format (starts with a letter and ends with 3 digits)
+    if not re.match(r'^[A-Za-z]\d{3}$', icao_code):
+        errors.append("ICAO Code must start with a letter and end with 3 digits (e.g., 'D123').")
+
+    # Validate Registration format (e.g., XX-YYY or XX-Y12)
+    if not re.match(r'^[A-Za-z]{2}-[A-Za-z0-9]{3}$', registration):
+        errors.append("Registration must follow the format 'XX-YYY' or 'XX-Y12'.")
+
+    # Check if manufacturer or model exceeds 100 characters
+    if len(manufacturer) > 100:
+        errors.append("Manufacturer cannot exceed 100 characters.")
+    if len(model) > 100:
+        errors.append("Model cannot exceed 100 characters.")
+
+    # Check if capacity is a valid integer
+    try:
+        capacity = int(capacity)
+        if capacity <= 0:
+            errors.append("Capacity must be a positive integer.")
+    except (TypeError, ValueError):
+        errors.append("Capacity must be a valid integer.")
+    return capacity
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Imports
+import configparser
+import logging
+import os
+import threading
+import time
+
+#  Shared configuration
+##     AppConfig(path, check_interval)
+##         .current()
+##         .on_reload(callback)
+##     get_config()
+##     on_config_reload(callback)
+
+
+################################################################################
+# Cached config.ini
+#   - The file is parsed once and the parsed ConfigParser is shared by
+#     routes.py and database.py
+#   - At most once every check_interval seconds we stat() the file, and only
+#     re-parse it when its mtime has changed
+#   - Callbacks registered with on_reload(callback) are called with the old
+#     and new ConfigParser after every reload
+################################################################################
+
+class AppConfig:
+
+    def __init__(self, path='config.ini', check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._config = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def current(self):
+        """ Returns the parsed config, reloading it if the file has changed."""
+        now = time.monotonic()
+        if self._config is not None and now - self._checked_at < self.check_interval:
+            return self._config
+
+        with self._lock:
+            if self._config is not None and now - self._checked_at < self.check_interval:
+                return self._config
+            self._checked_at = now
+
+            mtime = self._read_mtime()
+            if self._config is not None and mtime == self._mtime:
+                return self._config
+
+            old = self._config
+            self._config = self._parse()
+            self._mtime = mtime
+            new = self._config
+            callbacks = list(self._callbacks)
+
+        # Call listeners outside the lock so they are free to read the config
+        if old is not None:
+            logging.info(f"Reloaded {self.path}")
+            for callback in callbacks:
+                try:
+                    callback(old, new)
+                except Exception as e:
+                    logging.error(f"Error in config reload callback: {e}")
+        return new
+
+    def on_reload(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+        return callback
+
+    def _read_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _parse(self):
+        config = configparser.ConfigParser()
+        config.read(self.path)
+        return config
+
+
+# The one shared instance for the whole process
+_app_config = AppConfig('config.ini')
+
+def get_config():
+    return _app_config.current()
+
+def on_config_reload(callback):
+    return _app_config.on_reload(callback)
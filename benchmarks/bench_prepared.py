@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Compare plain parameterised queries with the prepared statement registry
+#
+#   python benchmarks/bench_prepared.py [--iterations 2000] [--aircraftid 1] [--userid someone]
+#
+# Needs the database from config.ini. For each point lookup it times
+# cursor.execute() (Parse, Describe, Bind and Execute every time, so Postgres
+# parses and plans on each call) against execute_prepared() (Bind and Execute
+# of a statement parsed once per connection), on the same pooled connection.
+
+# Imports
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import database
+
+LOOKUPS = [
+    # (name, registry statement, plain SQL, parameter name, command line option)
+    ('aircraft by id', 'get_aircraft_by_id', "SELECT * FROM aircraft WHERE aircraftid = %s", 'aircraftid', 'aircraftid'),
+    ('login join', 'check_login', database.PREPARED_STATEMENTS['check_login'].replace(':userid', '%s'), 'userid', 'userid'),
+    ('users by userid', 'list_users_by_userid', "SELECT * FROM users WHERE userid = %s", 'filterval', 'userid'),
+]
+
+
+def time_calls(call, iterations):
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--aircraftid', type=int, default=1)
+    parser.add_argument('--userid', default='1')
+    args = parser.parse_args()
+
+    conn = database.database_connect()
+    if conn is None:
+        print("Error: could not connect to the database, check config.ini")
+        return 1
+
+    try:
+        print(f"{'lookup':>16} {'method':>9} {'mean ms':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for label, name, sql, param, option in LOOKUPS:
+            value = getattr(args, option)
+            cursor = conn.cursor()
+
+            def plain():
+                cursor.execute(sql, (value,))
+                cursor.fetchall()
+
+            def prepared():
+                database.execute_prepared(conn, name, **{param: value})
+
+            # Warm up both paths (and prepare the statement) before timing
+            plain()
+            prepared()
+            for method, call in (('execute', plain), ('prepared', prepared)):
+                mean, p50, p99 = time_calls(call, args.iterations)
+                print(f"{label:>16} {method:>9} {mean * 1000:>9.3f} {p50 * 1000:>8.3f} {p99 * 1000:>8.3f}")
+            cursor.close()
+            conn.rollback()
+    finally:
+        database.database_release(conn)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
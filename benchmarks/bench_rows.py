@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Compare dict rows (dictfetchall) with compact rows (rowfetchall)
+#
+#   python benchmarks/bench_rows.py [--sizes 10000 100000 1000000]
+#
+# A fake cursor hands out pre-built tuples shaped like the users table, so
+# only the cost of turning driver rows into row objects is measured: the
+# peak memory the rows take (tracemalloc) and the time to build them, plus
+# the time to read every column back through row['name'].
+
+# Imports
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from database import dictfetchall, rowfetchall
+
+COLUMNS = ['userid', 'firstname', 'lastname', 'userroleid', 'password']
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.description = None
+
+    def execute(self, sqltext, params=None):
+        self.description = [(name, 25, None, None, None, None, None) for name in COLUMNS]
+
+    def fetchall(self):
+        return self.rows
+
+
+def make_rows(n):
+    return [(f"user{i}", f"First{i}", f"Last{i}", i % 4 + 1, "$2b$12$" + "x" * 53)
+            for i in range(n)]
+
+
+def measure(fetch, rows):
+    cursor = FakeCursor(rows)
+    gc.collect()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fetch(cursor, "SELECT * FROM users")
+    build_time = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for row in result:
+        for name in COLUMNS:
+            row[name]
+    read_time = time.perf_counter() - start
+
+    del result
+    return peak, build_time, read_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'factory':>12} {'peak MiB':>10} {'build s':>9} {'read s':>8}")
+    for n in args.sizes:
+        rows = make_rows(n)
+        for name, fetch in (('dictfetchall', dictfetchall), ('rowfetchall', rowfetchall)):
+            peak, build_time, read_time = measure(fetch, rows)
+            print(f"{n:>9} {name:>12} {peak / 2**20:>10.1f} {build_time:>9.3f} {read_time:>8.3f}")
+        del rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# End-to-end load test of every page, through the Flask test client
+#
+#   python benchmarks/load_test.py [--users 10000] [--aircraft 5000] [--roles 5]
+#                                  [--requests 200] [--concurrency 8] [--routes list_users ...]
+#                                  [--output results.json] [--compare earlier.json] [--keep]
+#
+# Needs the database from config.ini. It first seeds that database with
+# generated users, userroles and aircraft (all easy to tell apart from real
+# rows, and deleted again at the end unless --keep is given), logs in as a
+# generated admin, then sends --requests requests to each route from
+# --concurrency threads. For every route it records throughput, p50/p95/p99
+# latency and the process RSS, and writes them all to a JSON file named after
+# the current commit so runs can be compared with --compare.
+
+# Imports
+import argparse
+import csv
+import io
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BASE_DIR)
+import database
+from password_hashing import get_hasher
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Generated rows use ids no real row does, so they can be removed afterwards
+USER_PREFIX = 'bench_'
+ROLE_BASE = 9000                # userroleid of the first generated role; it is the admin role
+AIRCRAFT_BASE = 900000          # aircraft ids stay below the 1,000,000 the forms allow
+PASSWORD = 'bench-password'
+
+# Rows sent by each /users/batch request and each CSV import
+BATCH_USERS = 20
+IMPORT_ROWS = 50
+
+FIRSTNAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie']
+LASTNAMES = ['Nguyen', 'Smith', 'Chen', 'Patel', 'Brown', 'Wilson', 'Lee', 'Garcia']
+MANUFACTURERS = [('Boeing', '737'), ('Airbus', 'A320'), ('Embraer', 'E190'), ('Bombardier', 'Q400')]
+
+
+################################################################################
+# Seeding
+#   - COPY loads the generated users and aircraft in one round trip each;
+#     every user shares one password hash, so seeding does not wait on bcrypt
+#   - The summary tables are kept up to date by their triggers
+################################################################################
+
+def _copy_chunks(rows, size=5000):
+    # COPY reads an iterable of CSV text
+    for start in range(0, len(rows), size):
+        out = io.StringIO()
+        csv.writer(out).writerows(rows[start:start + size])
+        yield out.getvalue()
+
+
+def seed(args):
+    hashed = get_hasher().hash_password(PASSWORD)
+    roles = [(ROLE_BASE + i, f"{USER_PREFIX}role{i}", i == 0) for i in range(args.roles)]
+    users = [(f"{USER_PREFIX}{i}", random.choice(FIRSTNAMES), random.choice(LASTNAMES),
+              ROLE_BASE + i % args.roles, hashed) for i in range(args.users)]
+    aircraft = []
+    for i in range(args.aircraft):
+        manufacturer, model = random.choice(MANUFACTURERS)
+        aircraft.append((AIRCRAFT_BASE + i, f"B{i % 1000:03d}", f"VH-{i % 1000:03d}",
+                         manufacturer, model, random.randint(50, 400)))
+
+    conn = database.database_connect()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        _delete_seeded(cursor)
+        for row in roles:
+            cursor.execute("INSERT INTO userroles (userroleid, rolename, isadmin) VALUES (%s, %s, %s)", row)
+        cursor.execute("COPY users (userid, firstname, lastname, userroleid, password) FROM STDIN WITH (FORMAT csv)",
+                       stream=_copy_chunks(users))
+        cursor.execute("""COPY aircraft (aircraftid, icaocode, aircraftregistration, manufacturer, model, capacity)
+                          FROM STDIN WITH (FORMAT csv)""", stream=_copy_chunks(aircraft))
+        cursor.execute("ANALYZE users")
+        cursor.execute("ANALYZE aircraft")
+        database.database_commit(conn)
+    except Exception:
+        database.database_rollback(conn)
+        raise
+    finally:
+        cursor.close()
+        database.database_release(conn)
+    return {'users': [u[0] for u in users], 'aircraft': [a[0] for a in aircraft], 'admin': users[0][0]}
+
+
+def cleanup():
+    conn = database.database_connect()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        _delete_seeded(cursor)
+        database.database_commit(conn)
+    finally:
+        cursor.close()
+        database.database_release(conn)
+    return True
+
+
+def _delete_seeded(cursor):
+    cursor.execute("DELETE FROM users WHERE userid LIKE %s", (USER_PREFIX.replace('_', '\\_') + '%',))
+    cursor.execute("DELETE FROM aircraft WHERE aircraftid >= %s", (AIRCRAFT_BASE,))
+    cursor.execute("DELETE FROM userroles WHERE userroleid >= %s", (ROLE_BASE,))
+
+
+################################################################################
+# Routes
+#   - Each entry is (name, method, function returning (path, data)); the
+#     name is the Flask endpoint it exercises, with _post added when the
+#     endpoint is driven with both methods. data is form fields (a file is
+#     a (file, filename) pair), or a list, which is sent as JSON
+#   - Every route in routes.py and aircraft_routes.py is driven except
+#     download_profile, which needs a saved profile to fetch
+#   - Adds run before the deletes, which remove what the adds created;
+#     updates only touch generated rows, and never the admin we log in as;
+#     batch and CSV imports add generated rows, removed with the rest
+################################################################################
+
+class Scenario:
+
+    def __init__(self, seeded):
+        self.users = seeded['users']
+        self.aircraft = seeded['aircraft']
+        self._new_users = itertools.count()
+        self._new_aircraft = itertools.count(AIRCRAFT_BASE + len(self.aircraft))
+        self.added_users = []
+        self.added_aircraft = []
+        self._lock = threading.Lock()
+
+    def user(self):
+        return random.choice(self.users)
+
+    def other_user(self):
+        # Anyone but the admin, whose role must survive the updates
+        return random.choice(self.users[1:])
+
+    def aircraft_id(self):
+        return random.choice(self.aircraft)
+
+    def new_user(self):
+        userid = f"{USER_PREFIX}new{next(self._new_users)}"
+        with self._lock:
+            self.added_users.append(userid)
+        return ('/users/add', {'userid': userid, 'firstname': 'Load', 'lastname': 'Test',
+                               'userroleid': str(ROLE_BASE + 1), 'password': PASSWORD})
+
+    def new_aircraft(self):
+        aircraft_id = next(self._new_aircraft)
+        with self._lock:
+            self.added_aircraft.append(aircraft_id)
+        return ('/add_aircraft', {'AircraftID': str(aircraft_id), 'ICAOCode': 'B737', 'AircraftRegistration': 'VH-LDT',
+                                  'Manufacturer': 'Boeing', 'Model': '737', 'Capacity': '180'})
+
+    def new_user_batch(self):
+        first = next(self._new_users)
+        # Keep the counter clear of the ids this batch uses
+        for _ in range(BATCH_USERS - 1):
+            next(self._new_users)
+        return ('/users/batch', [{'userid': f"{USER_PREFIX}new{first + i}", 'firstname': 'Batch', 'lastname': 'Test',
+                                  'userroleid': ROLE_BASE + 1, 'password': PASSWORD} for i in range(BATCH_USERS)])
+
+    def aircraft_csv(self):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['AircraftID', 'ICAOCode', 'AircraftRegistration', 'Manufacturer', 'Model', 'Capacity'])
+        for _ in range(IMPORT_ROWS):
+            writer.writerow([next(self._new_aircraft), 'E190', 'VH-IMP', 'Embraer', 'E190', 100])
+        return ('/aircrafts/import', {'csvfile': (io.BytesIO(out.getvalue().encode('utf-8')), 'aircraft.csv')})
+
+    def added(self, pool):
+        # Hand each added row to exactly one delete
+        with self._lock:
+            return pool.pop() if pool else None
+
+    def routes(self):
+        return [
+            ('login', 'POST', lambda: ('/login', {'userid': self.user(), 'password': PASSWORD})),
+            ('index', 'GET', lambda: ('/', None)),
+            ('list_users', 'GET', lambda: ('/users', None)),
+            ('list_single_users', 'GET', lambda: (f'/users/{self.user()}', None)),
+            ('list_consolidated_users', 'GET', lambda: ('/consolidated/users', None)),
+            ('list_user_stats', 'GET', lambda: ('/user_stats', None)),
+            ('search_users_byname', 'POST', lambda: ('/users/search', {
+                'searchfield': random.choice(database.SEARCH_ATTRIBUTES),
+                'searchterm': random.choice(FIRSTNAMES + LASTNAMES)[:3],
+                'searchmode': random.choice(database.SEARCH_MODES[:3])})),
+            ('edit_user', 'GET', lambda: (f'/users/edit/{self.user()}', None)),
+            ('edit_user_post', 'POST', lambda: (f'/users/edit/{self.other_user()}', {
+                'userid': self.other_user(), 'firstname': random.choice(FIRSTNAMES), 'lastname': random.choice(LASTNAMES),
+                'userroleid': str(ROLE_BASE + 1)})),
+            ('add_user', 'POST', self.new_user),
+            ('add_users_batch', 'POST', self.new_user_batch),
+            ('update_user', 'POST', lambda: ('/users/update', {
+                'userid': self.other_user(), 'firstname': random.choice(FIRSTNAMES), 'lastname': random.choice(LASTNAMES),
+                'userroleid': str(ROLE_BASE + 1), 'password': PASSWORD})),
+            ('delete_user', 'GET', lambda: (f'/users/delete/{self.added(self.added_users)}', None)),
+            ('export_users', 'GET', lambda: (f"/users/export.{random.choice(database.EXPORT_FORMATS)}", None)),
+            ('list_aircrafts', 'GET', lambda: ('/aircrafts', None)),
+            ('view_aircraft', 'GET', lambda: (f'/aircraft/{self.aircraft_id()}', None)),
+            ('autocomplete_aircrafts', 'GET', lambda: (f'/aircrafts/autocomplete?q={random.choice(MANUFACTURERS)[0][:2]}', None)),
+            ('search_aircraft_by_id', 'POST', lambda: ('/search_aircraft_by_id', {'aircraft_id': str(self.aircraft_id())})),
+            ('aircraft_summary', 'GET', lambda: ('/aircraft_summary', None)),
+            ('add_aircraft', 'POST', self.new_aircraft),
+            ('import_aircrafts', 'POST', self.aircraft_csv),
+            ('update_aircraft', 'POST', lambda: (f'/update_aircraft/{self.aircraft_id()}', {
+                'ICAOCode': 'A320', 'AircraftRegistration': 'VH-UPD', 'Manufacturer': 'Airbus',
+                'Model': 'A320', 'Capacity': str(random.randint(50, 400))})),
+            ('delete_aircraft', 'POST', lambda: (f'/delete_aircraft/{self.added(self.added_aircraft)}', None)),
+            ('export_aircrafts', 'GET', lambda: (f"/aircrafts/export.{random.choice(database.EXPORT_FORMATS)}", None)),
+            ('metrics', 'GET', lambda: ('/metrics', None)),
+            ('list_profiles', 'GET', lambda: ('/profiles', None)),
+            # Last, since it ends the thread's session
+            ('logout', 'GET', lambda: ('/logout', None)),
+        ]
+
+
+################################################################################
+# Running and reporting
+################################################################################
+
+def rss_mb():
+    # Current resident set size; falls back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(samples, p):
+    # Nearest rank on sorted samples
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+
+def run_route(app, admin, method, make_request, requests, concurrency):
+    local = threading.local()
+
+    def client():
+        # One logged in test client per thread; they are not thread safe
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+            local.client.post('/login', data={'userid': admin, 'password': PASSWORD})
+        return local.client
+
+    def one(_):
+        path, data = make_request()
+        c = client()
+        t0 = time.perf_counter()
+        if isinstance(data, list):
+            response = c.open(path, method=method, json=data)
+        else:
+            response = c.open(path, method=method, data=data)
+        response.get_data()
+        elapsed = time.perf_counter() - t0
+        response.close()
+        return elapsed, response.status_code
+
+    rss_before = rss_mb()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Log every thread in before the clock starts; the barrier makes each
+        # worker thread take exactly one of these
+        ready = threading.Barrier(concurrency)
+        list(executor.map(lambda _: (client(), ready.wait()), range(concurrency)))
+        started = time.perf_counter()
+        results = list(executor.map(one, range(requests)))
+        wall = time.perf_counter() - started
+
+    samples = sorted(elapsed for elapsed, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': requests,
+        'errors': sum(count for status, count in statuses.items() if int(status) >= 500),
+        'statuses': statuses,
+        'throughput_rps': round(requests / wall, 1),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'rss_mb_before': round(rss_before, 1),
+        'rss_mb_after': round(rss_mb(), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, earlier_path):
+    with open(earlier_path) as f:
+        earlier = json.load(f)
+    print(f"\nAgainst {earlier_path} ({earlier.get('commit')}):")
+    print(f"{'route':>24} {'p50 ms':>16} {'p95 ms':>16} {'req/s':>16}")
+    for name, now in results['routes'].items():
+        before = earlier.get('routes', {}).get(name)
+        if before is None:
+            continue
+        cells = [f"{before[key]:>7} -> {now[key]:<7}" for key in ('p50_ms', 'p95_ms', 'throughput_rps')]
+        print(f"{name:>24} " + ' '.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--aircraft', type=int, default=5000)
+    parser.add_argument('--roles', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200, help='requests sent to each route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', nargs='*', help='only these routes (Flask endpoint names)')
+    parser.add_argument('--output', help=f'JSON results file (default: {RESULTS_DIR}/<time>-<commit>.json)')
+    parser.add_argument('--compare', help='an earlier results file to compare against')
+    parser.add_argument('--keep', action='store_true', help='leave the generated rows in the database')
+    args = parser.parse_args()
+    if args.roles < 2 or args.users < 2 or args.aircraft < 1 or args.aircraft + args.requests * (1 + IMPORT_ROWS) > 10**6 - AIRCRAFT_BASE:
+        parser.error("need at least 2 roles, 2 users and 1 aircraft, and the aircraft ids must stay below 1,000,000")
+
+    print(f"Seeding {args.users} users, {args.roles} roles and {args.aircraft} aircraft")
+    seeded = seed(args)
+    if seeded is None:
+        print("Error: could not connect to the database, check config.ini")
+        return 1
+
+    # The app prints a lot per request; keep the report readable
+    report = sys.stdout
+    from routes import app
+    scenario = Scenario(seeded)
+    results = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {k: getattr(args, k) for k in ('users', 'aircraft', 'roles', 'requests', 'concurrency')},
+        'routes': {},
+    }
+    try:
+        print(f"{'route':>24} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'5xx':>5} {'RSS MB':>7}")
+        for name, method, make_request in scenario.routes():
+            if args.routes and name not in args.routes:
+                continue
+            with open(os.devnull, 'w') as devnull:
+                sys.stdout = devnull
+                try:
+                    result = run_route(app, seeded['admin'], method, make_request, args.requests, args.concurrency)
+                finally:
+                    sys.stdout = report
+            results['routes'][name] = result
+            print(f"{name:>24} {result['throughput_rps']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+                  f"{result['p99_ms']:>8} {result['errors']:>5} {result['rss_mb_after']:>7}")
+    finally:
+        if not args.keep:
+            cleanup()
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{results['commit']}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Imports
+import gzip
+import zlib
+
+from flask import request
+
+from app_config import get_config
+
+#  gzip for dynamic responses
+##     init_compression(app)
+##     ETAG_SUFFIX
+
+# Types worth compressing; everything else (images, .gz downloads, ...) is left alone
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript',
+    'application/json', 'application/javascript', 'application/x-ndjson',
+}
+
+# Added to a response's ETag when its body is gzipped, since the compressed
+# bytes are a different representation (see http_caching.py)
+ETAG_SUFFIX = '-gz'
+
+
+################################################################################
+# Response compression
+#   - Runs after every view; if the client accepts gzip and the type is
+#     compressible, the body is gzipped at [COMPRESSION] level (default 6)
+#   - Buffered bodies smaller than [COMPRESSION] min_size bytes (default 1024)
+#     are sent as they are; they would barely shrink
+#   - Streamed bodies are compressed chunk by chunk with a sync flush after
+#     each one, so every chunk reaches the browser as soon as it is rendered
+#   - Vary: Accept-Encoding is set on every compressible response, gzipped
+#     or not, so shared caches keep the two apart
+################################################################################
+
+def init_compression(app):
+    config = get_config()
+    if not config.getboolean('COMPRESSION', 'enabled', fallback=True):
+        return
+    level = config.getint('COMPRESSION', 'level', fallback=6)
+    min_size = config.getint('COMPRESSION', 'min_size', fallback=1024)
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+
+        if (request.method == 'HEAD'
+                or not request.accept_encodings['gzip']
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers
+                or 'no-transform' in response.headers.get('Cache-Control', '')
+                or response.direct_passthrough):
+            return response
+
+        if response.is_streamed:
+            response.response = _gzip_stream(response.response, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(gzip.compress(data, compresslevel=level))
+
+        response.headers['Content-Encoding'] = 'gzip'
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(etag + ETAG_SUFFIX, weak)
+        return response
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Pass a client disconnect on to the wrapped body (see table_export.py)
+        if hasattr(chunks, 'close'):
+            chunks.close()
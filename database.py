@@ -1,14 +1,44 @@
 #!/usr/bin/env python3
 # Imports
 import pg8000
-import configparser
 import sys
-import bcrypt
+import logging
+import itertools
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, has_request_context
+
+from app_config import get_config, on_config_reload
+from db_pool import ConnectionPool, PoolExhaustedError
+from entity_cache import LRUCache, MISSING
+from metrics import POOL_ERRORS, POOL_WAIT_SECONDS, watch_cache
+from password_hashing import get_hasher
+from query_budget import current_tally, use_tally
+from query_log import record_query
 
 #  Common Functions
 ##     database_connect()
+##     database_release(connection)
+##     database_commit(connection)
+##     database_rollback(connection)
+##     after_transaction(callback)
+##     after_commit(callback)
+##     on_table_change(listener)
+##     init_request_scope(app)
+##     fan_out((function, arg, ...), ...)
 ##     dictfetchall(cursor,sqltext,params)
 ##     dictfetchone(cursor,sqltext,params)
+##     dictfetchstream(sqltext,params,batch_size)
+##     rowfetchall(cursor,sqltext,params)
+##     rowfetchone(cursor,sqltext,params)
+##     execute_prepared(connection,name,**params)
+##     dictfetchprepared(connection,name,**params)
+##     keyset_clause(keycolumn, after, before, limit)
+##     table_versions(tables)
+##     copy_export(table, columns, fmt, stream)
 ##     print_sql_string(inputstring, params)
 
 
@@ -16,49 +46,305 @@ import bcrypt
 # Connect to the database
 #   - This function reads the config file and tries to connect
 #   - This is the main "connection" function used to set up our connection
+#   - Connections now come from a process-wide pool (see db_pool.py), so every
+#     database_connect() must be paired with a database_release()
 ################################################################################
 
-def database_connect():
-    # Read the config file
-    config = configparser.ConfigParser()
-    config.read('config.ini')
+# The process-wide connection pool, created on first use
+_pool = None
+_pool_lock = threading.Lock()
+
+def read_connection_params(config=None):
+    # Read the (cached) config file
+    if config is None:
+        config = get_config()
 
     # Connection target and fallback
     connection_target = 'DATABASE'
-    
-    # Try to retrieve the necessary configuration from the file
-    try:
-        # Extract connection parameters from config file
-        database = config[connection_target].get('database', config[connection_target]['user'])
-        user = config[connection_target]['user']
-        password = config[connection_target]['password']
-        host = config[connection_target]['host']
-        port = int(config[connection_target]['port'])
 
-    except KeyError as e:
-        logging.error(f"Missing required config parameter: {e}")
-        return None
-    
-    connection = None
+    # Extract connection parameters from config file
+    params = {
+        'database': config[connection_target].get('database', config[connection_target]['user']),
+        'user': config[connection_target]['user'],
+        'password': config[connection_target]['password'],
+        'host': config[connection_target]['host'],
+        'port': int(config[connection_target]['port']),
+    }
+
+    # Pool settings, all optional
+    pool_settings = {
+        'min_size': config[connection_target].getint('pool_min_size', 1),
+        'max_size': config[connection_target].getint('pool_max_size', 10),
+        'idle_timeout': config[connection_target].getfloat('pool_idle_timeout', 300.0),
+        'wait_timeout': config[connection_target].getfloat('pool_wait_timeout', 10.0),
+        'health_check_interval': config[connection_target].getfloat('pool_health_check_interval', 5.0),
+    }
+    return params, pool_settings
 
+################################################################################
+# Query instrumentation
+#   - Every connection we open is an InstrumentedConnection, whose cursors
+#     time each execute() and hand the statement, duration and row count to
+#     query_log.record_query (sampled, and written off the request thread)
+#   - execute_prepared() does the same for prepared statements
+################################################################################
+
+class InstrumentedCursor(pg8000.legacy.Cursor):
+
+    def execute(self, operation, args=(), stream=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(operation, args, stream=stream)
+            failed = False
+            return result
+        finally:
+            record_query(operation, time.perf_counter() - started, self._rowcount_or_none(), error=failed)
+
+    def _rowcount_or_none(self):
+        try:
+            count = self.rowcount
+        except Exception:
+            return None
+        return count if count is not None and count >= 0 else None
+
+
+class InstrumentedConnection(pg8000.legacy.Connection):
+
+    def cursor(self):
+        return InstrumentedCursor(self)
+
+
+def open_connection(params):
+    # Establish the connection
+    connection = InstrumentedConnection(**params)
+
+    # Set the schema
+    with connection.cursor() as cursor:
+        cursor.execute("SET SCHEMA 'airline';")
+    connection.commit()
+    return connection
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                params, pool_settings = read_connection_params()
+                _pool = ConnectionPool(lambda: open_connection(params), **pool_settings)
+    else:
+        # Picks up config.ini edits; see _reload_pool below
+        get_config()
+    return _pool
+
+@on_config_reload
+def _reload_pool(old_config, new_config):
+    # Drain and rebuild the pool if the connection parameters changed
+    if _pool is None:
+        return
     try:
-        # Establish the connection
-        connection = pg8000.connect(database=database, user=user, password=password, host=host, port=port)
-        
-        # Set the schema
-        with connection.cursor() as cursor:
-            cursor.execute("SET SCHEMA 'airline';")
+        old = read_connection_params(old_config)
+        new = read_connection_params(new_config)
+    except (KeyError, ValueError) as e:
+        logging.error(f"Ignoring database settings from reloaded config: {e}")
+        return
+    if old != new:
+        params, pool_settings = new
+        logging.info("Database settings changed, rebuilding connection pool")
+        _pool.reconfigure(lambda: open_connection(params), **pool_settings)
 
+def database_connect():
+    # Inside a Flask request every call shares the request's connection
+    if has_request_context():
+        if g.get('_db_conn') is None:
+            g._db_conn = _borrow_connection()
+            g._db_failed = False
+        return g._db_conn
+    return _borrow_connection()
+
+def _borrow_connection():
+    # Try to borrow a connection from the pool
+    started = time.perf_counter()
+    try:
+        connection = get_pool().acquire()
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        return connection
+
+    except KeyError as e:
+        logging.error(f"Missing required config parameter: {e}")
+        POOL_ERRORS.labels('config').inc()
+    except PoolExhaustedError as e:
+        logging.error(f"Database connection pool exhausted: {e}")
+        POOL_ERRORS.labels('exhausted').inc()
     except pg8000.OperationalError as e:
         logging.error("Operational error while connecting to the database: Check your credentials or network.")
         logging.error(e)
+        POOL_ERRORS.labels('connect').inc()
     except pg8000.ProgrammingError as e:
         logging.error("Programming error in database connection or schema setup: Please check the configuration.")
         logging.error(e)
+        POOL_ERRORS.labels('connect').inc()
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
+        POOL_ERRORS.labels('other').inc()
+    return None
+
+def database_release(connection):
+    # Hand a connection from database_connect() back to the pool
+    # The request's shared connection is only released when the request ends
+    if connection is not None and not _is_request_connection(connection):
+        get_pool().release(connection)
+
+def database_commit(connection):
+    # Inside a request the commit is deferred until the request has finished
+    if _is_request_connection(connection):
+        g._db_dirty = True
+    else:
+        connection.commit()
+
+def database_rollback(connection):
+    # Roll back now so the connection is usable again, and make sure the rest
+    # of the request's unit of work is not committed either
+    if _is_request_connection(connection):
+        g._db_failed = True
+    connection.rollback()
+
+def _is_request_connection(connection):
+    return has_request_context() and connection is g.get('_db_conn')
+
+def after_transaction(callback):
+    # Run callback once the current unit of work has been committed or rolled
+    # back; outside a request writes commit straight away, so run it now
+    if has_request_context() and g.get('_db_conn') is not None:
+        g.setdefault('_db_after', []).append(callback)
+    else:
+        callback()
+
+def after_commit(callback):
+    # Like after_transaction, but callback is dropped if the work is rolled back
+    if has_request_context() and g.get('_db_conn') is not None:
+        g.setdefault('_db_after_commit', []).append(callback)
+    else:
+        callback()
+
+def has_pending_writes():
+    # True while this request has written something it has not committed yet
+    return has_request_context() and g.get('_db_dirty', False)
+
+# Listeners told, after commit, which table a write function changed:
+# listener(table_name); used to drop cached pages (see page_cache.py)
+_table_listeners = []
+
+def on_table_change(listener):
+    _table_listeners.append(listener)
+    return listener
+
+def _notify_table_change(table):
+    def notify():
+        for listener in _table_listeners:
+            try:
+                listener(table)
+            except Exception as e:
+                logging.error(f"Error in table change listener: {e}")
+    after_commit(notify)
+
+
+################################################################################
+# Per-request unit of work
+#   - The first database call in a request borrows a connection and stores it
+#     on Flask's g; every later call in that request reuses it
+#   - The transaction is committed once the view has returned a response
+#     (before it is sent, so a redirect never beats its own commit), or rolled
+#     back if anything failed, and the connection then goes back to the pool
+################################################################################
+
+def init_request_scope(app):
+    app.after_request(_commit_request_scope)
+    app.teardown_request(_end_request_scope)
+
+def _commit_request_scope(response):
+    failed = response.status_code >= 500
+    _finish_request_connection(commit=not failed)
+    return response
+
+def _end_request_scope(exc):
+    # Only still open if the view raised, or after_request never ran
+    _finish_request_connection(commit=False)
+
+def _finish_request_connection(commit):
+    conn = g.pop('_db_conn', None)
+    failed = g.pop('_db_failed', False)
+    g.pop('_db_dirty', None)
+    callbacks = g.pop('_db_after', [])
+    commit_callbacks = g.pop('_db_after_commit', [])
+    if conn is None:
+        return
+
+    try:
+        if commit and not failed:
+            conn.commit()
+            callbacks += commit_callbacks
+        else:
+            conn.rollback()
+    except Exception as e:
+        logging.error(f"Error finishing the request transaction: {e}")
+        get_pool().release(conn, discard=True)
+        raise
     finally:
-        return connection
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error in after_transaction callback: {e}")
+    get_pool().release(conn)
+
+################################################################################
+# Fan-out of independent reads
+#   - fan_out((function, arg, ...), ...) runs several database.py reads at
+#     the same time and returns their results in order, so a page waits for
+#     its slowest query rather than the sum of them
+#   - The first call runs on the calling thread (sharing the request's
+#     connection); the rest go to a bounded thread pool where each borrows
+#     its own pooled connection and only sees committed data
+#   - Once this request has written something, or when called from inside
+#     a fan-out worker, the calls simply run one after another here
+#   - An exception from any call is raised to the caller
+################################################################################
+
+_fan_out_executor = None
+_fan_out_lock = threading.Lock()
+_fan_out_local = threading.local()
+
+def fan_out(*calls):
+    if len(calls) <= 1 or has_pending_writes() or getattr(_fan_out_local, 'worker', False):
+        return [function(*args) for function, *args in calls]
+
+    tally = current_tally()
+    futures = [_get_fan_out_executor().submit(_fan_out_call, tally, function, *args)
+               for function, *args in calls[1:]]
+    try:
+        function, *args = calls[0]
+        first = function(*args)
+        return [first] + [future.result() for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
+
+def _fan_out_call(tally, function, *args):
+    _fan_out_local.worker = True
+    # Count the worker's queries against the request that fanned out
+    with use_tally(tally):
+        return function(*args)
+
+def _get_fan_out_executor():
+    global _fan_out_executor
+    with _fan_out_lock:
+        if _fan_out_executor is None:
+            # Keep some connections free for requests that are not fanning out
+            workers = get_config().getint('DATABASE', 'fan_out_workers', fallback=4)
+            _fan_out_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db-fan-out')
+        return _fan_out_executor
+
 
 ######################################
 # Database Helper Functions
@@ -74,7 +360,7 @@ def dictfetchall(cursor,sqltext,params=[]):
         cols = [a[0] for a in cursor.description]
         
         returnres = cursor.fetchall()
-        if returnres is not None or len(returnres > 0):
+        if returnres:
             for row in returnres:
                 result.append({a:b for a,b in zip(cols, row)})
 
@@ -97,6 +383,259 @@ def dictfetchone(cursor,sqltext,params=None):
     return result
 
 
+######################################
+# Compact rows
+#   - One RowColumns per query holds the column names; every Row is just
+#     that shared object plus the tuple the driver gave us
+#   - Rows still work like the dictionaries above: row['userid'],
+#     row.userid, row.get('userid', ''), keys(), items() and 'userid' in row
+######################################
+class RowColumns:
+    __slots__ = ('names', 'index')
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        # Later columns win on duplicate names, just like the dict rows
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_description(cls, description):
+        return cls(a[0] for a in description)
+
+
+class Row:
+    __slots__ = ('_columns', '_values')
+
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = values
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._columns.index[key]]
+        except KeyError:
+            # Positional access, like the tuple underneath
+            if isinstance(key, int):
+                return self._values[key]
+            raise
+
+    def __getattr__(self, name):
+        try:
+            return self._values[self._columns.index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def get(self, key, default=None):
+        i = self._columns.index.get(key)
+        return default if i is None else self._values[i]
+
+    def keys(self):
+        return self._columns.index.keys()
+
+    def values(self):
+        return [self._values[i] for i in self._columns.index.values()]
+
+    def items(self):
+        return [(name, self._values[i]) for name, i in self._columns.index.items()]
+
+    def __contains__(self, key):
+        return key in self._columns.index
+
+    def __iter__(self):
+        return iter(self._columns.index)
+
+    def __len__(self):
+        return len(self._columns.index)
+
+    def __eq__(self, other):
+        if isinstance(other, (Row, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def _asdict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"Row({self._asdict()!r})"
+
+
+def rowfetchall(cursor,sqltext,params=[]):
+    """ Returns query results as a list of compact Row objects."""
+    """ Same use as dictfetchall, but without building a dict per row"""
+
+    cursor.execute(sqltext,params)
+    if cursor.description is None:
+        return []
+    cols = RowColumns.from_description(cursor.description)
+    returnres = cursor.fetchall()
+    return [Row(cols, row) for row in returnres] if returnres else []
+
+def rowfetchone(cursor,sqltext,params=None):
+    """ Returns query results as a list holding at most one Row."""
+
+    cursor.execute(sqltext,params)
+    if cursor.description is None:
+        return []
+    returnres = cursor.fetchone()
+    if returnres is None:
+        return []
+    return [Row(RowColumns.from_description(cursor.description), returnres)]
+
+
+######################################
+# Prepared statement registry
+#   - The hot queries live here by name, written with :name parameters
+#   - Each pooled connection prepares a statement the first time it runs it
+#     and keeps it, so Postgres parses and plans it only once per connection
+#   - A new or recycled connection simply prepares again; if the server has
+#     forgotten a statement (error 26000) we prepare it afresh and retry once
+######################################
+PREPARED_STATEMENTS = {
+    'check_login': """SELECT *
+                FROM Users
+                    JOIN UserRoles ON
+                        (Users.userroleid = UserRoles.userroleid)
+                WHERE userid = :userid""",
+    'list_userroles': "SELECT * FROM userroles",
+    'list_users_by_userid': "SELECT * FROM users WHERE userid = :filterval",
+    'list_users_by_userroleid': "SELECT * FROM users WHERE userroleid = :filterval",
+    'add_user_insert': """INSERT into Users(userid, firstname, lastname, userroleid, password)
+                VALUES (:userid, :firstname, :lastname, :userroleid, :password)""",
+    'delete_user': "DELETE FROM users WHERE userid = :userid",
+    'get_aircraft_by_id': "SELECT * FROM aircraft WHERE aircraftid = :aircraftid",
+    'add_aircraft': """INSERT INTO aircraft (aircraftid, icaocode, aircraftregistration, manufacturer, model, capacity)
+                VALUES (:aircraftid, :icaocode, :registration, :manufacturer, :model, :capacity)""",
+    'update_aircraft': """UPDATE aircraft
+                SET icaocode = :icaocode, aircraftregistration = :registration, manufacturer = :manufacturer,
+                    model = :model, capacity = :capacity
+                WHERE aircraftid = :aircraftid""",
+    'delete_aircraft': "DELETE FROM aircraft WHERE aircraftid = :aircraftid",
+}
+
+# connection -> {statement name: pg8000 PreparedStatement}
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+def _get_prepared(connection, name, fresh=False):
+    with _prepared_lock:
+        statements = _prepared.setdefault(connection, {})
+        if fresh:
+            statements.pop(name, None)
+        statement = statements.get(name)
+    if statement is None:
+        statement = connection.prepare(PREPARED_STATEMENTS[name])
+        with _prepared_lock:
+            _prepared.setdefault(connection, {})[name] = statement
+    return statement
+
+def _forget_prepared(connection, name):
+    # The next use on this connection prepares the statement again
+    with _prepared_lock:
+        _prepared.get(connection, {}).pop(name, None)
+
+def execute_prepared(connection, name, **params):
+    """ Runs a registered statement by name, returns (column names, rows)."""
+    statement = _get_prepared(connection, name)
+    started = time.perf_counter()
+    rows = None
+    failed = True
+    try:
+        try:
+            rows = statement.run(**params)
+        except pg8000.DatabaseError as e:
+            if sqlstate(e) != '26000':
+                raise
+            # The server lost it (e.g. DISCARD ALL) and the transaction is
+            # aborted. Retrying after a rollback is only safe if that throws
+            # nothing away; if this request has already written, fail the
+            # whole request rather than commit only the writes after this one
+            if _is_request_connection(connection) and has_pending_writes():
+                _forget_prepared(connection, name)
+                database_rollback(connection)
+                raise
+            connection.rollback()
+            statement = _get_prepared(connection, name, fresh=True)
+            rows = statement.run(**params)
+        failed = False
+    finally:
+        record_query(PREPARED_STATEMENTS[name], time.perf_counter() - started,
+                     len(rows) if rows is not None else None, error=failed)
+    cols = [c['name'] for c in statement.row_desc] if statement.row_desc else []
+    return cols, rows
+
+def dictfetchprepared(connection, name, **params):
+    """ Same as dictfetchall, but for a statement from PREPARED_STATEMENTS."""
+    cols, rows = execute_prepared(connection, name, **params)
+    return [{a:b for a,b in zip(cols, row)} for row in rows]
+
+def sqlstate(error):
+    # The PostgreSQL error code behind a pg8000 exception, e.g. '42P01'
+    if error.args and isinstance(error.args[0], dict):
+        return error.args[0].get('C')
+    return None
+
+
+######################################
+# Keyset (seek method) pagination
+######################################
+def keyset_clause(keycolumn, after=None, before=None, limit=None):
+    """ Builds the WHERE/ORDER BY/LIMIT tail for a keyset page on keycolumn."""
+    """ Returns (sql, params); rows for a 'before' page come back in descending order"""
+
+    params = []
+    if before is not None:
+        sql = f"WHERE {keycolumn} < %s ORDER BY {keycolumn} DESC"
+        params.append(before)
+    elif after is not None:
+        sql = f"WHERE {keycolumn} > %s ORDER BY {keycolumn} ASC"
+        params.append(after)
+    else:
+        sql = f"ORDER BY {keycolumn} ASC"
+
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(int(limit))
+    return sql, params
+
+
+######################################
+# Streaming through a server-side cursor
+######################################
+_stream_cursor_ids = itertools.count()
+
+def dictfetchstream(sqltext, params=None, batch_size=500):
+    """ Yields query results one compact Row at a time."""
+    """ Rows come from a server-side cursor in batches of batch_size, so memory stays flat"""
+
+    conn = database_connect()
+    if conn is None:
+        return
+    cur = conn.cursor()
+    name = f"stream_cursor_{next(_stream_cursor_ids)}"
+
+    try:
+        # DECLARE needs a transaction, which pg8000 has already opened for us
+        cur.execute(f"DECLARE {name} NO SCROLL CURSOR FOR {sqltext}", params)
+        while True:
+            cur.execute(f"FETCH FORWARD {int(batch_size)} FROM {name}")
+            rows = cur.fetchall()
+            if not rows:
+                break
+            cols = RowColumns.from_description(cur.description)
+            for row in rows:
+                yield Row(cols, row)
+        cur.execute(f"CLOSE {name}")
+    except Exception:
+        # Re-raised so a streamed page is cut off rather than finished as
+        # though it were complete (and then given an ETag)
+        database_rollback(conn)
+        logging.exception("Error streaming from Database")
+        raise
+    finally:
+        cur.close()
+        database_release(conn)
+
+
 #####################################
 ##  Update Single Items by PK       #
 #####################################
@@ -104,6 +643,11 @@ def dictfetchone(cursor,sqltext,params=None):
 
 # Update a single user
 def update_single_user(userid, firstname, lastname, userroleid, password):
+    # Hash on the worker pool before we hold a connection
+    hashed_password = None
+    if password is not None:
+        hashed_password = get_hasher().hash_password(password)
+
     conn = database_connect()
     if conn is None:
         return None
@@ -123,24 +667,23 @@ def update_single_user(userid, firstname, lastname, userroleid, password):
         if userroleid is not None:
             setitems.append("userroleid = %s::bigint")
             values.append(userroleid)
-        if password is not None:
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        if hashed_password is not None:
             setitems.append("password = %s")
             values.append(hashed_password)
 
         if setitems:
             sql = f"UPDATE users SET {', '.join(setitems)} WHERE userid = %s;"
             values.append(userid)
-            print_sql_string(sql, tuple(values))
             cur.execute(sql, tuple(values))
-            conn.commit()
+            database_commit(conn)
+            _notify_table_change('users')
     except Exception as e:
-        conn.rollback()  # Rollback if there's an error
+        database_rollback(conn)  # Rollback if there's an error
         print(f"Error updating user: {e}")
         raise
     finally:
         cur.close()
-        conn.close()
+        database_release(conn)
 
 
 
@@ -149,28 +692,131 @@ def update_single_user(userid, firstname, lastname, userroleid, password):
 
 
 def add_user_insert(userid, firstname, lastname, userroleid, password):
+    # Hash on the worker pool before we hold a connection
+    hashed_password = get_hasher().hash_password(password)
+
     conn = database_connect()
     if conn is None:
         return None
     cur = conn.cursor()
 
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-
-    sql = """
-        INSERT into Users(userid, firstname, lastname, userroleid, password)
-        VALUES (%s, %s, %s, %s, %s);
-    """
-    print_sql_string(sql, (userid, firstname, lastname, userroleid, hashed_password))
     try:
-        cur.execute(sql, (userid, firstname, lastname, userroleid, hashed_password))
-        conn.commit()  # Commit the transaction
+        execute_prepared(conn, 'add_user_insert', userid=userid, firstname=firstname, lastname=lastname,
+                         userroleid=userroleid, password=hashed_password)
+        database_commit(conn)  # Commit the transaction
+        _notify_table_change('users')
     except Exception as e:
-        conn.rollback()  # Rollback if there's an error
+        database_rollback(conn)  # Rollback if there's an error
         print(f"Unexpected error adding a user: {e}")
         raise
     finally:
         cur.close()
-        conn.close()
+        database_release(conn)
+
+
+
+# Add many users at once (POST /users/batch)
+#   - users is a list of dicts with userid and password, and optionally
+#     firstname, lastname and userroleid (defaults as for /users/add)
+#   - Passwords are hashed in parallel across the hasher's worker processes
+#     before we take a connection
+#   - Rows go in chunk_size at a time with one multi-row INSERT each; a
+#     userid that already exists is skipped by ON CONFLICT and reported
+#   - A chunk that fails for another reason (say an unknown userroleid) is
+#     rolled back to its savepoint and retried row by row, so only the bad
+#     rows are rejected and the rest of the batch still goes in
+#   - Returns {'inserted': [userid, ...], 'rejected': [{'index', 'userid', 'error'}, ...]}
+BATCH_USER_DEFAULTS = {'firstname': 'Empty firstname', 'lastname': 'Empty lastname', 'userroleid': 1}
+
+def add_users_batch(users, chunk_size=500):
+    rejected = []
+    valid = []
+    seen = set()
+    for index, user in enumerate(users):
+        userid = user.get('userid') if isinstance(user, dict) else None
+        if userid is None or str(userid).strip() == '':
+            rejected.append({'index': index, 'userid': userid, 'error': "Missing userid"})
+        elif not user.get('password'):
+            rejected.append({'index': index, 'userid': userid, 'error': "Missing password"})
+        elif not isinstance(user['password'], str):
+            # bcrypt would fail the whole hash_many call on a number or a list
+            rejected.append({'index': index, 'userid': userid, 'error': "password must be a string"})
+        elif str(userid) in seen:
+            rejected.append({'index': index, 'userid': userid, 'error': "userid repeated in this batch"})
+        else:
+            seen.add(str(userid))
+            row = dict(BATCH_USER_DEFAULTS, userid=str(userid))
+            row.update((k, user[k]) for k in ('firstname', 'lastname', 'userroleid') if user.get(k) is not None)
+            valid.append((index, row, user['password']))
+
+    # Hash on the worker pool before we hold a connection
+    hashes = get_hasher().hash_many([password for _, _, password in valid])
+    for (_, row, _), hashed in zip(valid, hashes):
+        row['password'] = hashed
+
+    conn = database_connect()
+    if conn is None:
+        return None
+    cur = conn.cursor()
+    inserted = []
+
+    try:
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start:start + chunk_size]
+            failed = {}
+
+            cur.execute("SAVEPOINT add_users_batch")
+            try:
+                added = _insert_users(cur, [row for _, row, _ in chunk])
+            except pg8000.DatabaseError:
+                cur.execute("ROLLBACK TO SAVEPOINT add_users_batch")
+                added = set()
+                for _, row, _ in chunk:
+                    cur.execute("SAVEPOINT add_users_row")
+                    try:
+                        added |= _insert_users(cur, [row])
+                    except pg8000.DatabaseError as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT add_users_row")
+                        failed[row['userid']] = _error_message(e)
+                    cur.execute("RELEASE SAVEPOINT add_users_row")
+            cur.execute("RELEASE SAVEPOINT add_users_batch")
+
+            for index, row, _ in chunk:
+                if row['userid'] in added:
+                    inserted.append(row['userid'])
+                else:
+                    error = failed.get(row['userid'], "userid already exists")
+                    rejected.append({'index': index, 'userid': row['userid'], 'error': error})
+        database_commit(conn)
+        _notify_table_change('users')
+    except Exception as e:
+        database_rollback(conn)
+        print(f"Unexpected error adding a batch of users: {e}")
+        raise
+    finally:
+        cur.close()
+        database_release(conn)
+
+    rejected.sort(key=lambda r: r['index'])
+    return {'inserted': inserted, 'rejected': rejected}
+
+def _insert_users(cursor, rows):
+    # One multi-row INSERT; returns the userids that were actually added
+    values = []
+    for row in rows:
+        values.extend((row['userid'], row['firstname'], row['lastname'], row['userroleid'], row['password']))
+    placeholders = ", ".join(["(%s, %s, %s, %s::bigint, %s)"] * len(rows))
+    cursor.execute(f"""INSERT INTO users (userid, firstname, lastname, userroleid, password)
+                       VALUES {placeholders}
+                       ON CONFLICT (userid) DO NOTHING
+                       RETURNING userid""", values)
+    return {str(r[0]) for r in cursor.fetchall()}
+
+def _error_message(error):
+    # The server's message from a pg8000 error, without the rest of the dict
+    if error.args and isinstance(error.args[0], dict):
+        return error.args[0].get('M', str(error))
+    return str(error)
 
 
 
@@ -199,7 +845,6 @@ def check_login(username, password):
     '''
     # Ask for the database connection, and get the cursor set up
     conn = database_connect()
-    print("checking login")
 
 
     if conn is None:
@@ -208,21 +853,14 @@ def check_login(username, password):
 
 
     try:
-        sql = """SELECT *
-                FROM Users
-                    JOIN UserRoles ON
-                        (Users.userroleid = UserRoles.userroleid)
-                WHERE userid = %s"""
-        print_sql_string(sql, (username,))
-       
-        result = dictfetchone(cur, sql, (username,))  # Fetch the first row
+        result = dictfetchprepared(conn, 'check_login', userid=username)[:1]  # Fetch the first row
        
         if result:
             user_data = result[0]  # Get the first (and only) dictionary from the list
             stored_password = user_data['password']  # Access password using key
            
             # Check if the entered password matches the stored hashed password
-            if bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8')):
+            if get_hasher().check_password(password, stored_password):
                 return result  
             else:
                 print("Invalid password")
@@ -233,12 +871,13 @@ def check_login(username, password):
 
 
     except Exception as e:
+        database_rollback(conn)
         import traceback
         traceback.print_exc()
         print("Error Invalid Login")
     finally:
         cur.close()                    
-        conn.close()                    
+        database_release(conn)                    
    
     return None
 
@@ -248,7 +887,8 @@ def check_login(username, password):
 ########################
 
 # Get all the rows of users and return them as a dict
-def list_users():
+# after/before/limit select one keyset page ordered by userid
+def list_users(after=None, before=None, limit=None):
     # Get the database connection and set up the cursor
     conn = database_connect()
     if(conn is None):
@@ -260,28 +900,32 @@ def list_users():
 
     try:
         # Set-up our SQL query
-        sql = """SELECT *
-                    FROM users """
+        page_sql, params = keyset_clause('userid', after, before, limit)
+        sql = f"""SELECT *
+                    FROM users
+                    {page_sql} """
         
         # Retrieve all the information we need from the query
-        returndict = dictfetchall(cur,sql)
-
-        # report to the console what we recieved
-        print(returndict)
+        returndict = rowfetchall(cur,sql,params)
     except:
+        database_rollback(conn)
         # If there are any errors, we print something nice and return a null value
         import traceback
         traceback.print_exc()
         print("Error Fetching from Database", sys.exc_info()[0])
 
-    # Close our connections to prevent saturation
+    # Return our connection to the pool to prevent saturation
     cur.close()
-    conn.close()
+    database_release(conn)
 
     # return our struct
     return returndict
     
 
+# Every user, streamed a batch at a time
+def stream_users():
+    return dictfetchstream("SELECT * FROM users ORDER BY userid")
+
 def list_userroles():
     # Get the database connection and set up the cursor
     conn = database_connect()
@@ -294,21 +938,16 @@ def list_userroles():
 
     try:
         # Set-up our SQL query
-        sql = """SELECT *
-                    FROM userroles """
-        
-        # Retrieve all the information we need from the query
-        returndict = dictfetchall(cur,sql)
-
-        # report to the console what we recieved
-        print(returndict)
+        # Retrieve all the information we need from the prepared query
+        returndict = dictfetchprepared(conn, 'list_userroles')
     except:
+        database_rollback(conn)
         # If there are any errors, we print something nice and return a null value
         print("Error Fetching from Database", sys.exc_info()[0])
 
-    # Close our connections to prevent saturation
+    # Return our connection to the pool to prevent saturation
     cur.close()
-    conn.close()
+    database_release(conn)
 
     # return our struct
     return returndict
@@ -320,11 +959,6 @@ def list_userroles():
 
 # Get all rows in users where a particular attribute matches a value
 def list_users_equifilter(attributename, filterval):
-    # Get the database connection and set up the cursor
-    conn = database_connect()
-    if conn is None:
-        return None
-
     # Allowed attributes to filter by
     allowed_attributes = ['userid', 'username', 'email', 'userroleid']  # Update this list based on your schema
 
@@ -333,25 +967,36 @@ def list_users_equifilter(attributename, filterval):
         print(f"Invalid attribute name: {attributename}")
         return None
 
+    # Get the database connection and set up the cursor
+    conn = database_connect()
+    if conn is None:
+        return None
+
     # Set up the rows as a dictionary
     cur = conn.cursor()
     val = None
 
     try:
-        # Prepare the SQL statement using a placeholder
-        sql = f"""SELECT *
-                   FROM users
-                   WHERE {attributename} = %s """
-        
-        # Execute the query safely
-        val = dictfetchall(cur, sql, (filterval,))
+        statement = f"list_users_by_{attributename}"
+        if statement in PREPARED_STATEMENTS:
+            # The common filters are prepared once per connection
+            val = dictfetchprepared(conn, statement, filterval=filterval)
+        else:
+            # Prepare the SQL statement using a placeholder
+            sql = f"""SELECT *
+                       FROM users
+                       WHERE {attributename} = %s """
+            
+            # Execute the query safely
+            val = dictfetchall(cur, sql, (filterval,))
     except Exception as e:
+        database_rollback(conn)
         import traceback
         traceback.print_exc()
         print(f"Error Fetching from Database: {e}")
     finally:
         cur.close()  # Ensure the cursor is closed
-        conn.close()  # Ensure the connection is closed
+        database_release(conn)  # Ensure the connection goes back to the pool
 
     return val
 
@@ -363,7 +1008,8 @@ def list_users_equifilter(attributename, filterval):
 ###########################
     
 # # A report with the details of Users, Userroles
-def list_consolidated_users():
+# after/before/limit select one keyset page ordered by userid
+def list_consolidated_users(after=None, before=None, limit=None):
     # Get the database connection and set up the cursor
     conn = database_connect()
     if(conn is None):
@@ -375,27 +1021,47 @@ def list_consolidated_users():
 
     try:
         # Set-up our SQL query
-        sql = """SELECT *
+        page_sql, params = keyset_clause('users.userid', after, before, limit)
+        sql = f"""SELECT *
                 FROM users 
                     JOIN userroles 
-                    ON (users.userroleid = userroles.userroleid) ;"""
+                    ON (users.userroleid = userroles.userroleid)
+                {page_sql} ;"""
         
         # Retrieve all the information we need from the query
-        returndict = dictfetchall(cur,sql)
-
-        # report to the console what we recieved
-        print(returndict)
+        returndict = rowfetchall(cur,sql,params)
     except:
+        database_rollback(conn)
         # If there are any errors, we print something nice and return a null value
         print("Error Fetching from Database", sys.exc_info()[0])
 
-    # Close our connections to prevent saturation
+    # Return our connection to the pool to prevent saturation
     cur.close()
-    conn.close()
+    database_release(conn)
 
     # return our struct
     return returndict
 
+# Every user joined with their role, streamed a batch at a time
+def stream_consolidated_users():
+    return dictfetchstream("""SELECT *
+                FROM users
+                    JOIN userroles
+                    ON (users.userroleid = userroles.userroleid)
+                ORDER BY users.userid""")
+
+def fetch_summary(conn, cursor, summary_sql, scan_sql):
+    """ Reads a report from its trigger-maintained summary table."""
+    """ Falls back to the full GROUP BY scan if sql/001_summary_counts.sql is not applied"""
+    try:
+        return dictfetchall(cursor, summary_sql)
+    except pg8000.ProgrammingError as e:
+        if sqlstate(e) != '42P01':
+            raise
+        database_rollback(conn)
+        print("Summary tables missing, scanning instead. Run: python manage.py migrate")
+        return dictfetchall(cursor, scan_sql)
+
 def list_user_stats():
     # Get the database connection and set up the cursor
     conn = database_connect()
@@ -407,24 +1073,25 @@ def list_user_stats():
     returndict = None
 
     try:
-        # Set-up our SQL query
-        sql = """SELECT userroleid, COUNT(*) as count
+        # Set-up our SQL query, one row per role from the summary table
+        sql = """SELECT userroleid, count
+                FROM user_role_counts
+                    ORDER BY userroleid ASC ;"""
+        scan_sql = """SELECT userroleid, COUNT(*) as count
                 FROM users 
                     GROUP BY userroleid
                     ORDER BY userroleid ASC ;"""
         
         # Retrieve all the information we need from the query
-        returndict = dictfetchall(cur,sql)
-
-        # report to the console what we recieved
-        print(returndict)
+        returndict = fetch_summary(conn, cur, sql, scan_sql)
     except:
+        database_rollback(conn)
         # If there are any errors, we print something nice and return a null value
         print("Error Fetching from Database", sys.exc_info()[0])
 
-    # Close our connections to prevent saturation
+    # Return our connection to the pool to prevent saturation
     cur.close()
-    conn.close()
+    database_release(conn)
 
     # return our struct
     return returndict
@@ -437,11 +1104,6 @@ def list_user_stats():
 # Search for users with a custom filter
 # filtertype can be: '=', '<', '>', '<>', '~', 'LIKE'
 def search_users_customfilter(attributename, filtertype, filterval):
-    # Get the database connection and set up the cursor
-    conn = database_connect()
-    if conn is None:
-        return None
-
     # Allowed attributes and operators to filter by
     allowed_attributes = ['userid', 'username', 'email', 'userroleid','firstname','lastname']  # Allowed attributes
     allowed_filter_types = ['=', '<', '>', '<>', 'LIKE', '~']  # Allowed operators
@@ -456,6 +1118,11 @@ def search_users_customfilter(attributename, filtertype, filterval):
         print(f"Invalid filter type: {filtertype}")
         return None
 
+    # Get the database connection and set up the cursor
+    conn = database_connect()
+    if conn is None:
+        return None
+
     cur = conn.cursor()
     val = None
 
@@ -473,17 +1140,78 @@ def search_users_customfilter(attributename, filtertype, filterval):
                    WHERE lower({attributename}) {filtertype} {filtervalprefix}lower(%s){filtervalsuffix} """
         
         # Execute the query safely
-        val = dictfetchall(cur, sql, (filterval,))
+        val = rowfetchall(cur, sql, (filterval,))
     except Exception as e:
+        database_rollback(conn)
         import traceback
         traceback.print_exc()
         print(f"Error Fetching from Database: {e}")
     finally:
         cur.close()  # Ensure the cursor is closed
-        conn.close()  # Ensure the connection is closed
+        database_release(conn)  # Ensure the connection goes back to the pool
 
     return val
 
+# Index-backed user search (see sql/002_user_search_indexes.sql)
+#   - exact, prefix and substring build = / LIKE predicates on lower(attr)
+#     that the btree and trigram indexes can answer; LIKE wildcards typed
+#     by the user are escaped so they match literally
+#   - regex keeps the old lower(attr) ~ lower(term) behaviour, but only
+#     when asked for by name
+#   - At most limit rows come back, ordered by userid
+SEARCH_ATTRIBUTES = ['userid', 'firstname', 'lastname']
+SEARCH_MODES = ['exact', 'prefix', 'substring', 'regex']
+SEARCH_RESULT_LIMIT = 500
+
+def user_search_clause(attributename, mode, term):
+    """ Returns (sql, params) for a WHERE predicate matching term in attributename."""
+    if attributename not in SEARCH_ATTRIBUTES:
+        raise ValueError(f"Invalid attribute name: {attributename}")
+    column = f"lower({attributename})"
+
+    if mode == 'exact':
+        return f"{column} = lower(%s)", [term]
+    if mode == 'regex':
+        return f"{column} ~ lower(%s)", [term]
+
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    if mode == 'prefix':
+        return f"{column} LIKE lower(%s)", [escaped + '%']
+    if mode == 'substring':
+        return f"{column} LIKE lower(%s)", ['%' + escaped + '%']
+    raise ValueError(f"Invalid search mode: {mode}")
+
+def search_users(attributename, mode, term, limit=SEARCH_RESULT_LIMIT):
+    # Validate before we take a connection
+    try:
+        where, params = user_search_clause(attributename, mode, term)
+    except ValueError as e:
+        print(e)
+        return None
+
+    conn = database_connect()
+    if conn is None:
+        return None
+    cur = conn.cursor()
+    val = None
+
+    try:
+        sql = f"""SELECT *
+                  FROM users
+                  WHERE {where}
+                  ORDER BY userid
+                  LIMIT %s"""
+        val = rowfetchall(cur, sql, params + [int(limit)])
+    except Exception as e:
+        database_rollback(conn)
+        print(f"Error Fetching from Database: {e}")
+    finally:
+        cur.close()
+        database_release(conn)
+
+    return val
+
+
 
 ##  Delete
 ###     delete_user(userid)
@@ -494,58 +1222,119 @@ def delete_user(userid):
 
     cur = conn.cursor()
     try:
-        sql = "DELETE FROM users WHERE userid = %s;"
-        cur.execute(sql, (userid,))
-        conn.commit()  # Commit the transaction
+        execute_prepared(conn, 'delete_user', userid=userid)
+        database_commit(conn)  # Commit the transaction
+        _notify_table_change('users')
     except Exception as e:
-        conn.rollback()  # Rollback if there's an error
+        database_rollback(conn)  # Rollback if there's an error
         print(f"Unexpected error deleting user with id {userid}: {e}")
         raise
     finally:
         cur.close()
-        conn.close()
+        database_release(conn)
 
 
 
 
-# 1. List All Aircrafts
-def list_aircraft():
+# 1. List All Aircrafts (after/before/limit select one keyset page)
+def list_aircraft(after=None, before=None, limit=None):
     conn = database_connect()
     if conn is None:
         return None
     cursor = conn.cursor()
     try:
         # Set-up our SQL query
-        query = "SELECT * FROM aircraft ORDER BY aircraftid ASC"
-        # Use dictfetchall to fetch the result as dictionaries
-        aircrafts = dictfetchall(cursor, query)
+        page_sql, params = keyset_clause('aircraftid', after, before, limit)
+        query = f"SELECT * FROM aircraft {page_sql}"
+        # Use rowfetchall to fetch the result as compact dictionary-like rows
+        aircrafts = rowfetchall(cursor, query, params)
         return aircrafts
     except Exception as e:
+        database_rollback(conn)
         print(f"Unexpected error listing aircraft: {e}")
         return None
     finally:
         cursor.close()
-        conn.close()
+        database_release(conn)
+
+# 1b. Stream All Aircrafts a batch at a time
+def stream_aircraft():
+    return dictfetchstream("SELECT * FROM aircraft ORDER BY aircraftid ASC")
+
+# Read-through cache of single aircraft rows, keyed by aircraft id
+#   - Size and TTL come from the optional [CACHE] section of config.ini
+#   - add_aircraft, update_aircraft and delete_aircraft invalidate their key
+#     straight away and again when their transaction ends
+#   - A read that an invalidation overtook is not cached (see LRUCache.generation)
+#   - Hits, misses and evictions are exported at /metrics as cache="aircraft"
+aircraft_cache = watch_cache('aircraft', LRUCache(
+    maxsize=get_config().getint('CACHE', 'aircraft_cache_size', fallback=1024),
+    ttl=get_config().getfloat('CACHE', 'aircraft_cache_ttl', fallback=60.0)))
+
+def _aircraft_cache_key(aircraft_id):
+    try:
+        return int(aircraft_id)
+    except (TypeError, ValueError):
+        return aircraft_id
+
+def invalidate_aircraft(aircraft_id):
+    key = _aircraft_cache_key(aircraft_id)
+    aircraft_cache.invalidate(key)
+    after_transaction(lambda: aircraft_cache.invalidate(key))
+
+# Listeners told about every committed change to aircraft (see aircraft_index.py)
+#   - listener(aircraft_id, row) gets the new column values as a dict, or
+#     row=None once the aircraft has been deleted
+#   - aircraft_id=None means many rows changed at once (bulk import)
+_aircraft_listeners = []
+
+def on_aircraft_change(listener):
+    _aircraft_listeners.append(listener)
+    return listener
+
+def _notify_aircraft_change(aircraft_id, row):
+    _notify_table_change('aircraft')
+
+    def notify():
+        for listener in _aircraft_listeners:
+            try:
+                listener(aircraft_id, row)
+            except Exception as e:
+                logging.error(f"Error in aircraft change listener: {e}")
+    after_commit(notify)
+
+def _aircraft_row(aircraft_id, icao_code, registration, manufacturer, model, capacity):
+    return {'aircraftid': aircraft_id, 'icaocode': icao_code, 'aircraftregistration': registration,
+            'manufacturer': manufacturer, 'model': model, 'capacity': capacity}
 
 # 2. Get Aircraft by ID
 def get_aircraft_by_id(aircraft_id):
+    key = _aircraft_cache_key(aircraft_id)
+    aircraft = aircraft_cache.get(key)
+    if aircraft is not MISSING:
+        return aircraft
+    generation = aircraft_cache.generation()
+
     conn = database_connect()
     if conn is None:
         return None
     cursor = conn.cursor()
     try:
-        # SQL query to get a single aircraft by ID
-        query = "SELECT * FROM aircraft WHERE aircraftid = %s"
-        # Use dictfetchone to fetch the result as a dictionary
-        aircraft = dictfetchone(cursor, query, [aircraft_id])
-        # dictfetchone returns a list, so return the first element if found
-        return aircraft[0] if aircraft else None
+        # Prepared query to get a single aircraft by ID, as a dictionary
+        aircraft = dictfetchprepared(conn, 'get_aircraft_by_id', aircraftid=aircraft_id)
+        # dictfetchprepared returns a list, so take the first element if found
+        aircraft = aircraft[0] if aircraft else None
+        # Never cache a row this request has written but not yet committed
+        if aircraft is not None and not has_pending_writes():
+            aircraft_cache.put(key, aircraft, generation)
+        return aircraft
     except Exception as e:
+        database_rollback(conn)
         print(f"Unexpected error getting aircraft by ID: {e}")
         return None
     finally:
         cursor.close()
-        conn.close()
+        database_release(conn)
 
 # 3. Add New Aircraft (No changes needed here, this is for inserting data)
 def add_aircraft(aircraft_id, icao_code, registration, manufacturer, model, capacity):
@@ -554,19 +1343,19 @@ def add_aircraft(aircraft_id, icao_code, registration, manufacturer, model, capa
         return None
     cursor = conn.cursor()
     try:
-        query = """
-        INSERT INTO aircraft (aircraftid, icaocode, aircraftregistration, manufacturer, model, capacity)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(query, (aircraft_id, icao_code, registration, manufacturer, model, capacity))
-        conn.commit()  # Commit the transaction
+        execute_prepared(conn, 'add_aircraft', aircraftid=aircraft_id, icaocode=icao_code, registration=registration,
+                         manufacturer=manufacturer, model=model, capacity=capacity)
+        database_commit(conn)  # Commit the transaction
+        invalidate_aircraft(aircraft_id)
+        _notify_aircraft_change(aircraft_id, _aircraft_row(aircraft_id, icao_code, registration,
+                                                           manufacturer, model, capacity))
     except Exception as e:
-        conn.rollback()  # Rollback if there's an error
+        database_rollback(conn)  # Rollback if there's an error
         print(f"Unexpected error adding aircraft: {e}")
         raise
     finally:
         cursor.close()
-        conn.close()
+        database_release(conn)
 
 
 # 4. Update Aircraft (No changes needed here, this is for updating data)
@@ -576,19 +1365,18 @@ def update_aircraft(aircraft_id, icao_code, registration, manufacturer, model, c
         return None
     cursor = conn.cursor()
     try:
-        query = """
-        UPDATE aircraft
-        SET icaocode = %s, aircraftregistration = %s, manufacturer = %s, model = %s, capacity = %s
-        WHERE aircraftid = %s
-        """
-        cursor.execute(query, (icao_code, registration, manufacturer, model, capacity, aircraft_id))
-        conn.commit()
+        execute_prepared(conn, 'update_aircraft', aircraftid=aircraft_id, icaocode=icao_code, registration=registration,
+                         manufacturer=manufacturer, model=model, capacity=capacity)
+        database_commit(conn)
+        invalidate_aircraft(aircraft_id)
+        _notify_aircraft_change(aircraft_id, _aircraft_row(aircraft_id, icao_code, registration,
+                                                           manufacturer, model, capacity))
     except Exception as e:
         print(f"Unexpected error updating aircraft: {e}")
-        conn.rollback()
+        database_rollback(conn)
     finally:
         cursor.close()
-        conn.close()
+        database_release(conn)
 
 # 5. Delete Aircraft (No changes needed here, this is for deleting data)
 def delete_aircraft(aircraft_id):
@@ -597,15 +1385,16 @@ def delete_aircraft(aircraft_id):
         return None
     cursor = conn.cursor()
     try:
-        query = "DELETE FROM aircraft WHERE aircraftid = %s"
-        cursor.execute(query, (aircraft_id,))
-        conn.commit()
+        execute_prepared(conn, 'delete_aircraft', aircraftid=aircraft_id)
+        database_commit(conn)
+        invalidate_aircraft(aircraft_id)
+        _notify_aircraft_change(aircraft_id, None)
     except Exception as e:
         print(f"Unexpected error deleting aircraft: {e}")
-        conn.rollback()
+        database_rollback(conn)
     finally:
         cursor.close()
-        conn.close()
+        database_release(conn)
 
 # 6. Aircraft Summary (example: grouped by manufacturer)
 def aircraft_summary():
@@ -614,16 +1403,212 @@ def aircraft_summary():
         return None
     cursor = conn.cursor()
     try:
+        # One row per manufacturer from the summary table
         query = """
+        SELECT manufacturer, total_aircraft
+        FROM aircraft_manufacturer_counts
+        """
+        scan_query = """
         SELECT manufacturer, COUNT(*) AS total_aircraft
         FROM aircraft
         GROUP BY manufacturer
         """
-        summary = dictfetchall(cursor, query)
+        summary = fetch_summary(conn, cursor, query, scan_query)
         return summary
     except Exception as e:
+        database_rollback(conn)
         print(f"Unexpected error getting aircraft summary: {e}")
         return None
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        database_release(conn)
+
+# 7. Bulk load aircraft with COPY (see aircraft_import.py)
+#   - csv_chunks is an iterable of CSV text holding line_no followed by the
+#     six aircraft columns; COPY streams it into a temporary staging table
+#   - on_existing(line_no, aircraftid) is told about every staged row whose
+#     id is already in aircraft, read back a batch at a time
+#   - after_copy() runs once COPY has finished; raising there undoes it all
+#   - Everything happens in one transaction; returns the number of rows added
+def bulk_load_aircraft(csv_chunks, on_existing, after_copy=None, batch_size=1000):
+    conn = database_connect()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""CREATE TEMP TABLE aircraft_import (line_no BIGINT, LIKE aircraft)
+                          ON COMMIT DROP""")
+        cursor.execute("""COPY aircraft_import (line_no, aircraftid, icaocode, aircraftregistration,
+                                                manufacturer, model, capacity)
+                          FROM STDIN WITH (FORMAT csv)""", stream=csv_chunks)
+        if after_copy is not None:
+            after_copy()
+
+        cursor.execute("""DECLARE aircraft_import_clashes NO SCROLL CURSOR FOR
+                          SELECT i.line_no, i.aircraftid
+                          FROM aircraft_import i JOIN aircraft a ON (a.aircraftid = i.aircraftid)
+                          ORDER BY i.line_no""")
+        while True:
+            cursor.execute(f"FETCH FORWARD {int(batch_size)} FROM aircraft_import_clashes")
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for line_no, aircraftid in rows:
+                on_existing(line_no, aircraftid)
+        cursor.execute("CLOSE aircraft_import_clashes")
+
+        cursor.execute("""INSERT INTO aircraft (aircraftid, icaocode, aircraftregistration, manufacturer, model, capacity)
+                          SELECT aircraftid, icaocode, aircraftregistration, manufacturer, model, capacity
+                          FROM aircraft_import
+                          ON CONFLICT (aircraftid) DO NOTHING""")
+        inserted = cursor.rowcount
+        cursor.execute("DROP TABLE aircraft_import")
+        database_commit(conn)
+        if inserted:
+            _notify_aircraft_change(None, None)
+        return inserted
+    except Exception as e:
+        database_rollback(conn)
+        print(f"Unexpected error bulk loading aircraft: {e}")
+        raise
+    finally:
+        cursor.close()
+        database_release(conn)
+
+# 8. Rebuild the summary counts from scratch (python manage.py reconcile-summaries)
+def reconcile_summaries():
+    conn = database_connect()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT rebuild_summary_counts()")
+        database_commit(conn)
+        return True
+    except Exception as e:
+        database_rollback(conn)
+        print(f"Unexpected error rebuilding summary counts: {e}")
+        raise
+    finally:
+        cursor.close()
+        database_release(conn)
+
+
+################################
+##  Table versions             #
+################################
+
+# Current version of each table in tables, as {table: 'version.microseconds'}
+#   - The newest row the triggers in sql/003_table_versions.sql append to
+#     table_changes on every write, from any process
+#   - Returns None when the versions can not be read (no connection, or the
+#     migration has not been applied), meaning "unknown, do not cache"; a
+#     missing table is only looked for again once a minute
+_table_versions_retry_at = 0.0
+
+def table_versions(tables):
+    global _table_versions_retry_at
+    if time.monotonic() < _table_versions_retry_at:
+        return None
+
+    conn = database_connect()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""SELECT DISTINCT ON (table_name) table_name, change_id,
+                                 (extract(epoch FROM changed_at) * 1000000)::bigint
+                          FROM table_changes
+                          WHERE table_name = ANY(%s)
+                          ORDER BY table_name, change_id DESC""", (list(tables),))
+        versions = {name: f"{version}.{changed}" for name, version, changed in cursor.fetchall()}
+        if len(versions) != len(set(tables)):
+            return None
+        return versions
+    except pg8000.ProgrammingError as e:
+        database_rollback(conn)
+        if sqlstate(e) == '42P01':
+            _table_versions_retry_at = time.monotonic() + 60.0
+            print("table_changes is missing, pages will not send ETags. Run: python manage.py migrate")
+        else:
+            print(f"Error reading table versions: {e}")
+        return None
+    finally:
+        cursor.close()
+        database_release(conn)
+
+
+################################
+##  Exports (COPY ... TO)      #
+################################
+
+# Columns each table may be exported with, in their default order and with
+# the column rows are ordered by first; users.password is never exported
+EXPORT_COLUMNS = {
+    'users': ['userid', 'firstname', 'lastname', 'userroleid'],
+    'aircraft': ['aircraftid', 'icaocode', 'aircraftregistration', 'manufacturer', 'model', 'capacity'],
+}
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+# Write a whole table to stream.write() straight from COPY ... TO STDOUT
+#   - columns must come from EXPORT_COLUMNS[table], they are put into the SQL
+#   - csv has a header line; ndjson is one JSON object per line, built by
+#     row_to_json and sent through csv mode with quote and delimiter
+#     characters that JSON text never contains, so it arrives unescaped
+#   - pg8000 hands over the rows one at a time as they arrive, nothing is
+#     collected in memory
+#   - if stream.write() raises, COPY is abandoned half way, so the connection
+#     is closed rather than returned to the pool
+def copy_export(table, columns, fmt, stream):
+    allowed = EXPORT_COLUMNS[table]
+    unknown = [c for c in columns if c not in allowed]
+    if unknown or not columns:
+        raise ValueError(f"Cannot export column(s) {', '.join(unknown) or '(none)'} from {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    select = f"SELECT {', '.join(columns)} FROM {table} ORDER BY {allowed[0]}"
+    if fmt == 'csv':
+        sql = f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)"
+    else:
+        sql = (f"COPY (SELECT row_to_json(t) FROM ({select}) t) TO STDOUT "
+               f"WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')")
+
+    conn = _borrow_connection()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, stream=stream)
+    except Exception as e:
+        print(f"Error exporting {table}: {e}")
+        cursor.close()
+        get_pool().release(conn, discard=True)
+        raise
+    cursor.close()
+    get_pool().release(conn)
+    return True
+
+
+################################
+##  Schema changes (sql/*.sql) #
+################################
+
+# Run a whole SQL file; without parameters pg8000 sends it as one simple
+# query, so several statements and $$-quoted function bodies are fine
+def run_sql_script(sqltext):
+    conn = database_connect()
+    if conn is None:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sqltext)
+        database_commit(conn)
+        return True
+    except Exception as e:
+        database_rollback(conn)
+        print(f"Unexpected error running SQL script: {e}")
+        raise
+    finally:
+        cursor.close()
+        database_release(conn)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# Imports
+import threading
+import time
+import logging
+
+#  Connection Pool
+##     PoolExhaustedError
+##     ConnectionPool(connect_fn, min_size, max_size, idle_timeout, wait_timeout, health_check_interval)
+##         .acquire()
+##         .release(conn, discard=False)
+##         .reconfigure(connect_fn, **settings)
+##         .close_all()
+
+
+class PoolExhaustedError(Exception):
+    """ Raised when no connection became free within the pool's wait limit."""
+
+
+################################################################################
+# Connection Pool
+#   - Keeps a bounded set of open database connections that the functions in
+#     database.py borrow with acquire() and hand back with release()
+#   - connect_fn is called whenever a new connection has to be opened
+#   - Connections idle for longer than idle_timeout are closed, but we never
+#     drop below min_size
+#   - A connection that has been idle longer than health_check_interval is
+#     pinged with SELECT 1 before it is handed out again
+#   - reconfigure() starts a new generation: idle connections are closed
+#     straight away and checked out ones are closed when they come back
+################################################################################
+
+class ConnectionPool:
+
+    def __init__(self, connect_fn, min_size=1, max_size=10, idle_timeout=300.0,
+                 wait_timeout=10.0, health_check_interval=5.0):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if min_size < 0 or min_size > max_size:
+            raise ValueError("min_size must be between 0 and max_size")
+
+        self.connect_fn = connect_fn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.health_check_interval = health_check_interval
+
+        # Idle connections as (connection, time returned, generation); used LIFO so
+        # the warmest connection is handed out first and the coldest ones age out
+        self._idle = []
+        # Number of open connections, both idle and checked out
+        self._size = 0
+        # Generation each checked out connection was opened in, by id()
+        self._generation = 0
+        self._checked_out = {}
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def acquire(self):
+        """ Borrow a connection, waiting up to wait_timeout for one to be free."""
+        deadline = time.monotonic() + self.wait_timeout
+
+        while True:
+            conn, idle_since, generation, connect_fn = self._checkout(deadline)
+
+            if conn is None:
+                # We reserved a slot, so open a brand new connection for it
+                try:
+                    conn = connect_fn()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                return self._track(conn, generation)
+
+            if time.monotonic() - idle_since < self.health_check_interval or self._is_healthy(conn):
+                return self._track(conn, generation)
+
+            # Dead connection, throw it away and try again
+            logging.warning("Discarding unhealthy pooled connection")
+            self._discard(conn)
+
+    def release(self, conn, discard=False):
+        """ Return a borrowed connection to the pool."""
+        if conn is None:
+            return
+
+        if not discard:
+            try:
+                # Never hand out a connection in the middle of a transaction
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            generation = self._checked_out.pop(id(conn), self._generation)
+            if (discard or self._closed or generation != self._generation
+                    or getattr(conn, '_sock', True) is None):
+                self._size -= 1
+                self._cond.notify()
+            else:
+                self._idle.append((conn, time.monotonic(), generation))
+                self._cond.notify()
+                return
+
+        self._close_quietly(conn)
+
+    def reconfigure(self, connect_fn=None, **settings):
+        """ Switch to new connection parameters or pool settings, draining
+            every connection that was opened with the old ones."""
+        with self._cond:
+            if connect_fn is not None:
+                self.connect_fn = connect_fn
+            for name, value in settings.items():
+                if not hasattr(self, name):
+                    raise TypeError(f"Unknown pool setting: {name}")
+                setattr(self, name, value)
+
+            self._generation += 1
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def close_all(self):
+        """ Close every idle connection; checked out ones are closed on release."""
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_size': self.max_size,
+            }
+
+    ######################################
+    # Internal helpers
+    ######################################
+
+    def _checkout(self, deadline):
+        """ Returns (conn, idle_since, generation, connect_fn) for an idle
+            connection, or conn=None once a slot has been reserved for a new one."""
+        expired = []
+        try:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolExhaustedError("Connection pool has been closed")
+
+                    expired.extend(self._reap_idle())
+
+                    if self._idle:
+                        conn, idle_since, generation = self._idle.pop()
+                        return conn, idle_since, generation, self.connect_fn
+
+                    if self._size < self.max_size:
+                        self._size += 1
+                        return None, None, self._generation, self.connect_fn
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhaustedError(
+                            f"No database connection available after {self.wait_timeout}s "
+                            f"(max_size={self.max_size})")
+                    self._cond.wait(remaining)
+        finally:
+            for conn in expired:
+                self._close_quietly(conn)
+
+    def _reap_idle(self):
+        """ Pull out connections that have idled past idle_timeout (caller holds the lock)."""
+        if self.idle_timeout is None or len(self._idle) == 0:
+            return []
+
+        now = time.monotonic()
+        expired = []
+        # Oldest connections sit at the front of the list
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn = self._idle.pop(0)[0]
+            self._size -= 1
+            expired.append(conn)
+        return expired
+
+    def _track(self, conn, generation):
+        with self._cond:
+            self._checked_out[id(conn)] = generation
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Imports
+import threading
+import time
+from collections import OrderedDict
+
+#  In-process LRU cache
+##     LRUCache(maxsize, ttl)
+##         .get(key)          -> value or MISSING
+##         .generation()     -> token to pass to put()
+##         .put(key, value, generation=None)
+##         .invalidate(key)
+##         .clear()
+##         .stats()
+
+# Returned by get() when a key is not cached (None is a valid cached value)
+MISSING = object()
+
+
+################################################################################
+# LRU cache with a size bound and a time-to-live
+#   - Holds at most maxsize entries, evicting the least recently used one
+#   - Entries older than ttl seconds are treated as missing
+#   - Counts hits, misses and evictions so we can see whether it is worth it
+#   - A read-through caller takes generation() before it reads the value and
+#     hands it to put(); if the key was invalidated in between, the value may
+#     be stale and put() drops it
+#   - The last maxsize invalidations are remembered per key; past that, put()
+#     drops anything read before the oldest one it still remembers
+################################################################################
+
+class LRUCache:
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # invalidate() and clear() bump the generation; _invalidated holds the
+        # generation each recently invalidated key was last dropped at
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return MISSING
+
+    def put(self, key, value, generation=None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and (generation < self._floor
+                                           or self._invalidated.get(key, 0) > generation):
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > max(self.maxsize, 1):
+                _, self._floor = self._invalidated.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._invalidated.clear()
+            self._floor = self._generation
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Imports
+import functools
+import hashlib
+
+from flask import make_response, request, session
+
+import database
+from compression import ETAG_SUFFIX
+
+#  Conditional GET for pages built from database tables
+##     conditional_get(*tables)
+##     page_etag(tables)
+
+# Session values that change what a page looks like; the rendered-page
+# cache (page_cache.py) keys on the same ones
+PAGE_SESSION_KEYS = ('logged_in', 'isadmin')
+
+
+def page_etag(tables):
+    """ A strong ETag for the current GET request, or None if it can not be known.
+        It covers the endpoint, its arguments, the query string, the session role
+        and the version of every table the page reads."""
+    versions = database.table_versions(tables)
+    if versions is None:
+        return None
+
+    parts = [request.endpoint, repr(sorted(request.view_args.items())),
+             repr(sorted(request.args.items(multi=True)))]
+    parts += [f"{key}={session.get(key)!r}" for key in PAGE_SESSION_KEYS]
+    parts += [f"{table}@{versions[table]}" for table in sorted(versions)]
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+################################################################################
+# Conditional GET
+#   - @conditional_get('users', ...) on a view answers If-None-Match with
+#     304 Not Modified while none of the listed tables has changed, without
+#     running the view (so no page query and no template render)
+#   - Pages are marked private, no-cache: browsers keep them but check back
+#     with the ETag every time
+#   - Skipped when flash messages are waiting, since they are only shown by
+#     actually rendering the page
+################################################################################
+
+def conditional_get(*tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            etag = page_etag(tables)
+            if etag is None:
+                return view(*args, **kwargs)
+
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            elif etag + ETAG_SUFFIX in request.if_none_match:
+                # The browser holds the gzipped copy (see compression.py)
+                response = make_response('', 304)
+                etag += ETAG_SUFFIX
+            else:
+                response = make_response(view(*args, **kwargs))
+                # Only send an ETag for a page that has shown everything it
+                # flashed (a streamed page renders after we return)
+                if response.status_code != 200 or session.get('_flashes'):
+                    return response
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
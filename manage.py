@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Command line maintenance tasks
+#
+#   python manage.py migrate                 apply every sql/*.sql file in order
+#   python manage.py reconcile-summaries     recount the /user_stats and /aircraft_summary tables
+#   python manage.py import-aircraft FILE    bulk load aircraft from a CSV file
+#   python manage.py build-static            fingerprint and precompress static/ into static/dist/
+#   python manage.py clear-metrics           empty [METRICS] multiprocess_dir; run before starting the workers
+
+# Imports
+import argparse
+import glob
+import os
+import sys
+
+import database
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql')
+
+
+def migrate(args):
+    files = args.files or sorted(glob.glob(os.path.join(SQL_DIR, '*.sql')))
+    for path in files:
+        print(f"Applying {path}")
+        with open(path) as f:
+            if database.run_sql_script(f.read()) is None:
+                print("Error: could not connect to the database, check config.ini")
+                return 1
+    return 0
+
+
+def reconcile_summaries(args):
+    if database.reconcile_summaries() is None:
+        print("Error: could not connect to the database, check config.ini")
+        return 1
+    print("Summary counts rebuilt")
+    return 0
+
+
+def import_aircraft(args):
+    from aircraft_import import import_aircraft_csv, ImportFileError
+
+    report_path = args.report or os.path.splitext(args.file)[0] + '.rejected.csv'
+    with open(args.file, encoding='utf-8-sig', newline='') as source, \
+         open(report_path, 'w', encoding='utf-8', newline='') as report:
+        try:
+            counts = import_aircraft_csv(source, report)
+        except (ImportFileError, ConnectionError) as e:
+            print(f"Error: {e}")
+            return 1
+
+    print(f"Read {counts['read']} rows: loaded {counts['loaded']}, rejected {counts['rejected']}")
+    if counts['rejected']:
+        print(f"Rejected rows and reasons written to {report_path}")
+    return 0
+
+
+def build_static(args):
+    from static_assets import build_static as build
+
+    manifest = build()
+    print(f"Fingerprinted {len(manifest)} files into static/dist (restart the app to use them)")
+    return 0
+
+
+def clear_metrics(args):
+    from metrics import clear_snapshots
+
+    print(f"Removed {clear_snapshots()} metrics snapshots")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintenance tasks for the airline app")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('migrate', help="apply the SQL files in sql/")
+    command.add_argument('files', nargs='*', help="only apply these files")
+    command.set_defaults(run=migrate)
+
+    command = commands.add_parser('reconcile-summaries', help="rebuild the summary count tables")
+    command.set_defaults(run=reconcile_summaries)
+
+    command = commands.add_parser('import-aircraft', help="bulk load aircraft from a CSV file")
+    command.add_argument('file', help="CSV file with a header line")
+    command.add_argument('--report', help="where to write rejected rows (default FILE.rejected.csv)")
+    command.set_defaults(run=import_aircraft)
+
+    command = commands.add_parser('build-static', help="fingerprint and precompress the static files")
+    command.set_defaults(run=build_static)
+
+    command = commands.add_parser('clear-metrics', help="remove the metrics snapshots of earlier runs")
+    command.set_defaults(run=clear_metrics)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
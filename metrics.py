@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+# Imports
+import atexit
+import bisect
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import Response, before_render_template, g, request, template_rendered
+
+from app_config import get_config
+from password_hashing import get_hasher
+
+#  In-process metrics, exposed in Prometheus text format
+##     Counter(name, help, labelnames)
+##         .labels(*values).inc(amount)   (.inc(amount) when unlabelled)
+##     Histogram(name, help, labelnames, buckets)
+##         .labels(*values).observe(seconds)   (.observe(seconds) when unlabelled)
+##     collector(function)       (called before every snapshot)
+##     watch_cache(name, cache)  (export an LRUCache's hits, misses and evictions)
+##     render_metrics()          -> str (all workers when multiprocess_dir is set)
+##     clear_snapshots()         -> number of files removed (before the workers start)
+##     init_metrics(app)
+
+# Seconds; wide enough for a 1 ms cache hit and a 10 s export
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+################################################################################
+# Metric types
+#   - Each labelled child is one small list of numbers behind its own lock;
+#     recording a value holds that lock for a single list update, and only
+#     requests recording the very same series ever wait on each other
+################################################################################
+
+class _Child:
+
+    def __init__(self, size):
+        self._values = [0] * size
+        self._lock = threading.Lock()
+
+    def values(self):
+        with self._lock:
+            return list(self._values)
+
+
+class _CounterChild(_Child):
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._values[0] += amount
+
+    def set_total(self, value):
+        # For collectors copying a running total kept elsewhere
+        with self._lock:
+            self._values[0] = value
+
+
+class _HistogramChild(_Child):
+    """ Slots: one count per bucket, one for +Inf, then the running sum."""
+
+    def __init__(self, buckets):
+        super().__init__(len(buckets) + 2)
+        self._buckets = buckets
+
+    def observe(self, value):
+        slot = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._values[slot] += 1
+            self._values[-1] += value
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def snapshot(self):
+        with self._lock:
+            children = list(self._children.items())
+        return {
+            'kind': self.kind,
+            'help': self.help,
+            'labelnames': list(self.labelnames),
+            'buckets': list(getattr(self, 'buckets', [])),
+            'samples': [[list(key), child.values()] for key, child in children],
+        }
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class _Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Error in metrics collector: {e}")
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = _Registry()
+
+
+################################################################################
+# The metrics this app records
+################################################################################
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds',
+                            'Time from routing to the response being returned, by endpoint',
+                            ['endpoint', 'method', 'status'])
+REQUEST_ERRORS = Counter('http_request_errors_total',
+                         'Requests that raised or returned a 5xx, by endpoint', ['endpoint'])
+DB_SECONDS = Histogram('db_query_duration_seconds',
+                       'Time spent running SQL, by the database.py function that ran it', ['function'])
+DB_ERRORS = Counter('db_query_errors_total', 'Statements that raised, by database.py function', ['function'])
+TEMPLATE_SECONDS = Histogram('template_render_duration_seconds', 'Jinja render time, by template', ['template'])
+POOL_WAIT_SECONDS = Histogram('db_pool_wait_seconds', 'Time spent waiting to borrow a pooled connection')
+POOL_ERRORS = Counter('db_pool_errors_total', 'Failed attempts to borrow a pooled connection', ['reason'])
+HASH_OPERATIONS = Counter('password_hash_operations_total',
+                          'Password hashes and checks, by phase (queue_wait, hash_time)', ['phase'])
+HASH_SECONDS = Counter('password_hash_seconds_total',
+                       'Seconds spent waiting for a hash worker, and hashing, by phase', ['phase'])
+HASH_REJECTED = Counter('password_hash_rejected_total', 'Hashes refused because the queue was full')
+CACHE_HITS = Counter('cache_hits_total', 'Lookups answered from an in-process LRU cache', ['cache'])
+CACHE_MISSES = Counter('cache_misses_total', 'Lookups an in-process LRU cache could not answer', ['cache'])
+CACHE_EVICTIONS = Counter('cache_evictions_total', 'Entries pushed out of an in-process LRU cache', ['cache'])
+
+
+################################################################################
+# Collectors
+#   - Some numbers are already counted where they happen (the password
+#     hasher's and the LRU caches' stats()); a collector copies them in
+#     just before each snapshot, so recording them costs nothing extra
+#   - The hasher's worker processes import password_hashing, so it must not
+#     import this module (and Flask with it); we read from it instead
+################################################################################
+
+def collector(function):
+    return REGISTRY.add_collector(function)
+
+
+@collector
+def _collect_password_hashing():
+    stats = get_hasher().stats()
+    for phase in ('queue_wait', 'hash_time'):
+        HASH_OPERATIONS.labels(phase).set_total(stats[phase]['count'])
+        HASH_SECONDS.labels(phase).set_total(stats[phase]['total'])
+    HASH_REJECTED.labels().set_total(stats['rejected'])
+
+
+def watch_cache(name, cache):
+    @collector
+    def collect_cache():
+        stats = cache.stats()
+        CACHE_HITS.labels(name).set_total(stats['hits'])
+        CACHE_MISSES.labels(name).set_total(stats['misses'])
+        CACHE_EVICTIONS.labels(name).set_total(stats['evictions'])
+    return cache
+
+
+################################################################################
+# Exposition
+#   - render_metrics() returns every metric in Prometheus text format
+#   - With several worker processes, set [METRICS] multiprocess_dir: each
+#     process writes its numbers there every flush_interval seconds (and on
+#     exit) and /metrics adds up every file, so any worker gives the totals
+#   - The directory must be local to the host (dead workers are found by pid)
+#     and must be emptied before the workers start, with
+#     python manage.py clear-metrics (or clear_snapshots() in the server's
+#     start hook); otherwise every restart adds the last run's totals again
+#   - A worker that has exited is folded into archived.json on the next
+#     flush, so its requests still count but its file is not read again
+################################################################################
+
+_settings = get_config()
+MULTIPROCESS_DIR = _settings.get('METRICS', 'multiprocess_dir', fallback=None)
+FLUSH_INTERVAL = _settings.getfloat('METRICS', 'flush_interval', fallback=5.0)
+ARCHIVE_NAME = 'archived.json'
+_snapshot_path = None
+
+
+def render_metrics():
+    snapshots = [REGISTRY.snapshot()]
+    if MULTIPROCESS_DIR:
+        _write_snapshot()
+        snapshots = _read_snapshots()
+    return _format(_merge(snapshots))
+
+
+def init_metrics(app):
+    """ Time every request and template render, and serve /metrics."""
+    app.before_request(_start_request_timer)
+    app.after_request(_observe_request)
+    app.teardown_request(_observe_request_error)
+    before_render_template.connect(_start_render_timer, app)
+    template_rendered.connect(_observe_render, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+
+    global _snapshot_path
+    if MULTIPROCESS_DIR and _snapshot_path is None:
+        os.makedirs(MULTIPROCESS_DIR, exist_ok=True)
+        # Start time in the name so a reused pid never overwrites a dead worker
+        _snapshot_path = os.path.join(MULTIPROCESS_DIR, f"{os.getpid()}-{int(time.time() * 1000)}.json")
+        threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True).start()
+        atexit.register(_write_snapshot)
+
+
+def metrics_endpoint():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def _start_request_timer():
+    g._metrics_started = time.perf_counter()
+
+
+def _observe_request(response):
+    started = g.pop('_metrics_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.labels(endpoint, request.method, response.status_code).observe(time.perf_counter() - started)
+        if response.status_code >= 500:
+            REQUEST_ERRORS.labels(endpoint).inc()
+    return response
+
+
+def _observe_request_error(exc):
+    # Only reached with a timer still set if the view raised
+    if g.pop('_metrics_started', None) is not None and exc is not None:
+        REQUEST_ERRORS.labels(request.endpoint or 'unmatched').inc()
+
+
+def _start_render_timer(sender, template, context, **extra):
+    g.setdefault('_metrics_renders', []).append(time.perf_counter())
+
+
+def _observe_render(sender, template, context, **extra):
+    starts = g.get('_metrics_renders')
+    if starts:
+        TEMPLATE_SECONDS.labels(template.name).observe(time.perf_counter() - starts.pop())
+
+
+def _flush_forever():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            _write_snapshot()
+            _archive_dead_snapshots()
+        except OSError as e:
+            print(f"Could not write metrics snapshot: {e}")
+
+
+def _write_snapshot():
+    if _snapshot_path is None:
+        return
+    _write_json(_snapshot_path, REGISTRY.snapshot())
+
+
+def _write_json(path, snapshot):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temporary, path)
+
+
+def clear_snapshots():
+    """ Remove every worker's snapshot; run before the workers start."""
+    if not MULTIPROCESS_DIR or not os.path.isdir(MULTIPROCESS_DIR):
+        return 0
+    removed = 0
+    for path in glob.glob(os.path.join(MULTIPROCESS_DIR, '*.json')) + glob.glob(os.path.join(MULTIPROCESS_DIR, '*.tmp')):
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _snapshot_pid(path):
+    # Worker files are named {pid}-{started ms}.json
+    try:
+        return int(os.path.basename(path).split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _archive_dead_snapshots():
+    # One worker at a time, so a dead worker is never folded in twice
+    with open(os.path.join(MULTIPROCESS_DIR, '.archive.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = [path for path in glob.glob(os.path.join(MULTIPROCESS_DIR, '*.json'))
+                if _snapshot_pid(path) is not None and not _pid_alive(_snapshot_pid(path))]
+        if not dead:
+            return
+        archive = os.path.join(MULTIPROCESS_DIR, ARCHIVE_NAME)
+        snapshots = []
+        for path in [archive] + dead:
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except FileNotFoundError:
+                continue
+        merged = _merge(snapshots)
+        for metric in merged.values():
+            metric['samples'] = [[list(key), values] for key, values in metric['samples'].items()]
+        _write_json(archive, merged)
+        for path in dead:
+            os.remove(path)
+
+
+def _read_snapshots():
+    snapshots = []
+    for path in glob.glob(os.path.join(MULTIPROCESS_DIR, '*.json')):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # Being replaced right now; it will be there next scrape
+            continue
+    return snapshots
+
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for key, values in metric['samples']:
+                key = tuple(key)
+                current = target['samples'].get(key)
+                target['samples'][key] = values if current is None else [a + b for a, b in zip(current, values)]
+    return merged
+
+
+def _format(merged):
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labelnames = metric['labelnames']
+        for key in sorted(metric['samples']):
+            values = metric['samples'][key]
+            labels = list(zip(labelnames, key))
+            if metric['kind'] == 'counter':
+                lines.append(f"{name}{_labels(labels)} {_number(values[0])}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric['buckets']) + ['+Inf'], values[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append(f"{name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(values[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Imports
+import functools
+import threading
+
+from flask import current_app, make_response, message_flashed, request, session
+
+import database
+from app_config import get_config
+from entity_cache import LRUCache, MISSING
+from http_caching import PAGE_SESSION_KEYS
+from metrics import watch_cache
+
+#  Server-side cache of rendered pages
+##     cached_page(*tables)
+##     page_cache
+
+# Rendered pages, bounded by the optional [CACHE] page_cache_size and page_cache_ttl;
+# hits and misses are exported at /metrics as cache="pages"
+page_cache = watch_cache('pages', LRUCache(
+    maxsize=get_config().getint('CACHE', 'page_cache_size', fallback=128),
+    ttl=get_config().getfloat('CACHE', 'page_cache_ttl', fallback=30.0)))
+
+# Bumped whenever a table is written to; part of every key, so writing a
+# table leaves all pages built from it unreachable
+_generations = {}
+_generations_lock = threading.Lock()
+
+
+@database.on_table_change
+def _table_changed(table):
+    with _generations_lock:
+        _generations[table] = _generations.get(table, 0) + 1
+
+
+def _page_key(tables):
+    with _generations_lock:
+        generations = tuple(_generations.get(table, 0) for table in tables)
+    return (request.endpoint,
+            tuple(sorted(request.view_args.items())),
+            tuple(sorted(request.args.items(multi=True))),
+            tuple(session.get(key) for key in PAGE_SESSION_KEYS),
+            generations)
+
+
+################################################################################
+# Rendered-page cache
+#   - @cached_page('users', ...) on a view keeps its rendered 200 response,
+#     keyed on the route, its arguments, the session role and the tables'
+#     write generations
+#   - database.py write functions report the table they changed once it is
+#     committed, which drops every page built from that table; writes from
+#     other processes are picked up when the entry's TTL runs out
+#   - Pages that flash a message, and requests with flashes waiting, are
+#     never cached or answered from the cache
+#   - Every response says X-Cache: HIT, MISS or BYPASS
+################################################################################
+
+def cached_page(*tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                response = make_response(view(*args, **kwargs))
+                response.headers['X-Cache'] = 'BYPASS'
+                return response
+
+            key = _page_key(tables)
+            cached = page_cache.get(key)
+            if cached is not MISSING:
+                body, status, headers = cached
+                response = current_app.response_class(body, status=status, headers=headers)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            flashed = []
+            def record_flash(sender, message, category):
+                flashed.append(message)
+
+            with message_flashed.connected_to(record_flash, current_app._get_current_object()):
+                response = make_response(view(*args, **kwargs))
+
+            if response.status_code == 200 and not flashed and not response.is_streamed:
+                headers = [(k, v) for k, v in response.headers.items() if k.lower() != 'set-cookie']
+                page_cache.put(key, (response.get_data(), response.status_code, headers))
+                response.headers['X-Cache'] = 'MISS'
+            else:
+                response.headers['X-Cache'] = 'BYPASS'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Imports
+from flask import request
+
+#  Keyset pagination for list pages
+##     page_args(key_type)
+##     keyset_page(list_function, keyname, after, before, limit)
+
+# Rows per page when the request does not ask for a limit, and the most we allow
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def page_args(key_type=str):
+    """ Reads the after/before/limit query parameters of the current request."""
+    after = request.args.get('after', type=key_type)
+    before = request.args.get('before', type=key_type)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return after, before, limit
+
+
+def keyset_page(list_function, keyname, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+    """ Fetches one page through list_function(after=, before=, limit=).
+        Returns (rows, pager) where pager holds the keys for the next/prev links."""
+
+    # Ask for one extra row so we know whether there is another page
+    rows = list_function(after=after, before=before, limit=limit + 1)
+    if rows is None:
+        return None, None
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        # 'before' pages are fetched newest-first, put them back in order
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+
+    pager = {
+        'limit': limit,
+        'prev': rows[0][keyname] if rows and has_prev else None,
+        'next': rows[-1][keyname] if rows and has_next else None,
+    }
+    return rows, pager
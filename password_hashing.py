@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Imports
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from app_config import get_config
+
+#  Password hashing off the request thread
+##     HashQueueFull
+##     PasswordHasher(workers, queue_depth, rounds, queue_timeout)
+##         .hash_password(password)            -> bytes
+##         .check_password(password, hashed)   -> bool
+##         .hash_many(passwords)               -> list of bytes
+##         .stats()
+##     get_hasher()
+
+
+class HashQueueFull(Exception):
+    """ Raised when too many hashes are already waiting for a worker."""
+
+
+################################################################################
+# Worker functions
+#   - These run inside the pool's processes, so they must stay at module level
+#   - Each returns its result, the wall clock time it started and how long
+#     bcrypt took, so the parent can tell queue wait from hash time
+################################################################################
+
+def _hash_worker(password, rounds):
+    started = time.time()
+    t0 = time.perf_counter()
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+    return hashed, started, time.perf_counter() - t0
+
+def _check_worker(password, hashed):
+    started = time.time()
+    t0 = time.perf_counter()
+    ok = bcrypt.checkpw(password, hashed)
+    return ok, started, time.perf_counter() - t0
+
+
+################################################################################
+# Password hasher
+#   - bcrypt runs in a pool of worker processes, so a burst of logins uses
+#     every core and never holds up the threads serving other routes
+#   - At most queue_depth hashes may be in flight; callers wait up to
+#     queue_timeout seconds for a slot and then get HashQueueFull
+#   - workers = 0 hashes inline on the calling thread
+################################################################################
+
+class PasswordHasher:
+
+    def __init__(self, workers=None, queue_depth=None, rounds=12, queue_timeout=5.0):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.queue_depth = queue_depth or max(1, workers) * 4
+        self.rounds = rounds
+        self.queue_timeout = queue_timeout
+
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # name -> [count, total seconds, max seconds]
+        self._timings = {'queue_wait': [0, 0.0, 0.0], 'hash_time': [0, 0.0, 0.0]}
+        self.rejected = 0
+
+    def hash_password(self, password):
+        return self._run(_hash_worker, self._encode(password), self.rounds)
+
+    def check_password(self, password, hashed):
+        return self._run(_check_worker, self._encode(password), self._encode(hashed))
+
+    def hash_many(self, passwords):
+        """ Hashes a batch in parallel across the workers, keeping the order."""
+        if self.workers == 0:
+            return [self.hash_password(p) for p in passwords]
+
+        pending = []
+        try:
+            for password in passwords:
+                pending.append(self._submit(_hash_worker, self._encode(password), self.rounds))
+            return [self._collect(*p) for p in pending]
+        finally:
+            # Anything not collected (after an error) still holds a slot
+            for future, _ in pending:
+                if not future.done():
+                    future.cancel()
+
+    def stats(self):
+        with self._lock:
+            result = {'workers': self.workers, 'queue_depth': self.queue_depth,
+                      'rounds': self.rounds, 'rejected': self.rejected}
+            for name, (count, total, worst) in self._timings.items():
+                result[name] = {'count': count, 'total': total, 'max': worst,
+                                'avg': total / count if count else 0.0}
+            return result
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    ######################################
+    # Internal helpers
+    ######################################
+
+    def _run(self, worker, *args):
+        if self.workers == 0:
+            result, started, elapsed = worker(*args)
+            self._record('hash_time', elapsed)
+            return result
+        return self._collect(*self._submit(worker, *args))
+
+    def _submit(self, worker, *args):
+        submitted = time.time()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HashQueueFull(f"More than {self.queue_depth} password hashes already queued")
+        try:
+            future = self._get_executor().submit(worker, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future, submitted
+
+    def _collect(self, future, submitted):
+        result, started, elapsed = future.result()
+        self._record('queue_wait', max(0.0, started - submitted))
+        self._record('hash_time', elapsed)
+        return result
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the web process has threads and open sockets.
+                # spawn re-runs the entry script as __mp_main__, so web_app.py
+                # keeps the app out of that case
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _record(self, name, seconds):
+        with self._lock:
+            timing = self._timings[name]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    @staticmethod
+    def _encode(value):
+        return value.encode('utf-8') if isinstance(value, str) else value
+
+
+# The process-wide hasher, configured from the optional [SECURITY] section
+_hasher = None
+_hasher_lock = threading.Lock()
+
+def get_hasher():
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                config = get_config()
+                workers = config.get('SECURITY', 'hash_workers', fallback=None)
+                _hasher = PasswordHasher(
+                    workers=int(workers) if workers is not None else None,
+                    queue_depth=config.getint('SECURITY', 'hash_queue_depth', fallback=0) or None,
+                    rounds=config.getint('SECURITY', 'bcrypt_rounds', fallback=12),
+                    queue_timeout=config.getfloat('SECURITY', 'hash_queue_timeout', fallback=5.0))
+    return _hasher
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# Imports
+import collections
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from flask import abort, flash, g, redirect, render_template, request, send_from_directory, session, url_for
+
+from app_config import get_config
+
+#  Opt-in per-request sampling profiler
+##     init_profiler(app)
+##     list_profiles()            -> [profile details, newest first]
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# An admin asks for a profile with this header, or this query parameter
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = '_profile'
+
+
+################################################################################
+# Sampler
+#   - A helper thread looks at the request thread's stack every interval_ms
+#     and counts each distinct stack
+#   - The result is written in the collapsed format ("outer;inner;leaf 12"
+#     per line) read by flamegraph.pl, speedscope and similar tools
+#   - The request thread itself runs untouched; only the helper does work
+################################################################################
+
+class _Sampler(threading.Thread):
+
+    def __init__(self, thread_id, interval, max_seconds):
+        super().__init__(name='request-profiler', daemon=True)
+        self.counts = collections.Counter()
+        self._target = thread_id
+        self._interval = interval
+        self._deadline = time.monotonic() + max_seconds
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            if time.monotonic() > self._deadline:
+                return
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self.counts[_collapse(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.counts
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '?')
+        names.append(f"{module}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+################################################################################
+# Profiling hook
+#   - A request is profiled when an admin sends the X-Profile header or
+#     ?_profile=1, or at random with probability [PROFILER] sample_rate
+#     (default 0); [PROFILER] enabled = false removes the hook altogether
+#   - Requests that are not picked only pay for that check: no sampler
+#     thread is started and nothing is recorded
+#   - Each profile is saved in [PROFILER] dir (default profiles/) as a
+#     .folded stack file plus a .json with the request details; only the
+#     newest [PROFILER] keep (default 50) are kept
+#   - Sampling stops at teardown; a streamed page (see streaming.py) tears
+#     down only once its body has been sent, so its rendering and the
+#     queries run while streaming are included, as is its ms
+################################################################################
+
+class _Settings:
+    def __init__(self, config):
+        self.enabled = config.getboolean('PROFILER', 'enabled', fallback=True)
+        self.sample_rate = config.getfloat('PROFILER', 'sample_rate', fallback=0.0)
+        self.interval = config.getfloat('PROFILER', 'interval_ms', fallback=5.0) / 1000.0
+        self.max_seconds = config.getfloat('PROFILER', 'max_seconds', fallback=60.0)
+        self.keep = config.getint('PROFILER', 'keep', fallback=50)
+        self.directory = config.get('PROFILER', 'dir', fallback=os.path.join(BASE_DIR, 'profiles'))
+
+
+_settings = _Settings(get_config())
+
+
+def init_profiler(app):
+    app.add_url_rule('/profiles', 'list_profiles', profiles_page)
+    app.add_url_rule('/profiles/<name>', 'download_profile', download_profile)
+    if not _settings.enabled:
+        return
+    os.makedirs(_settings.directory, exist_ok=True)
+    app.before_request(_start_profile)
+    app.after_request(_note_status)
+    app.teardown_request(_finish_profile)
+
+
+def _requested_by_admin():
+    # Only look at the session when asked, so other responses don't vary on the cookie
+    if PROFILE_HEADER not in request.headers and PROFILE_PARAM not in request.args:
+        return False
+    return bool(session.get('isadmin'))
+
+
+def _start_profile():
+    if _requested_by_admin():
+        trigger = 'admin'
+    elif _settings.sample_rate and random.random() < _settings.sample_rate:
+        trigger = 'sampled'
+    else:
+        return
+    sampler = _Sampler(threading.get_ident(), _settings.interval, _settings.max_seconds)
+    g._profile = (sampler, trigger, time.perf_counter())
+    sampler.start()
+
+
+def _note_status(response):
+    if '_profile' in g:
+        g._profile_status = response.status_code
+    return response
+
+
+def _finish_profile(exc):
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return
+    sampler, trigger, started = profile
+    counts = sampler.stop()
+    details = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': 500 if exc is not None else g.get('_profile_status'),
+        'ms': round((time.perf_counter() - started) * 1000.0, 1),
+        'samples': sum(counts.values()),
+        'trigger': trigger,
+    }
+    try:
+        _save_profile(counts, details)
+    except OSError as e:
+        print(f"Could not save profile: {e}")
+
+
+def _save_profile(counts, details):
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    details['name'] = name + '.folded'
+    with open(os.path.join(_settings.directory, name + '.folded'), 'w') as f:
+        for stack, count in counts.most_common():
+            f.write(f"{stack} {count}\n")
+    # The .json is written last, so the list never shows a profile without its stacks
+    with open(os.path.join(_settings.directory, name + '.json'), 'w') as f:
+        json.dump(details, f)
+
+    for old in sorted(glob.glob(os.path.join(_settings.directory, '*.json')))[:-_settings.keep]:
+        for path in (old, old[:-len('.json')] + '.folded'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(_settings.directory, '*.json')), reverse=True):
+        try:
+            with open(path) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            # Removed by another worker while we looked
+            continue
+    return profiles
+
+
+################################################################################
+# Admin pages
+################################################################################
+
+def profiles_page():
+    if not session.get('isadmin'):
+        flash('Only admins can view profiles.', 'error')
+        return redirect(url_for('index'))
+    return render_template('list_profiles.html', session=session, page={'title': 'Request Profiles'},
+                           profiles=list_profiles(), enabled=_settings.enabled,
+                           header=PROFILE_HEADER, param=PROFILE_PARAM)
+
+
+def download_profile(name):
+    if not session.get('isadmin'):
+        abort(403)
+    if not name.endswith('.folded') or os.path.basename(name) != name:
+        abort(404)
+    return send_from_directory(_settings.directory, name, mimetype='text/plain', as_attachment=True)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# Imports
+import collections
+import contextlib
+import logging
+import threading
+
+from flask import current_app, g, has_request_context, request
+
+from app_config import get_config
+from query_log import fingerprint, on_query
+
+#  Per-request query counting and budgets
+##     query_budget(limit)           (view decorator)
+##     init_query_budget(app)
+##     current_tally()               -> QueryTally or None
+##     use_tally(tally)              (context manager, for worker threads)
+
+# Statements run by the pool itself (health checks, new connections) are
+# not the view's doing and vary from one request to the next
+IGNORED_CALLERS = {'database.open_connection'}
+IGNORED_MODULES = {'db_pool'}
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryTally:
+    """ The statements one request has run, by fingerprint."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, sql, seconds):
+        key = fingerprint(sql)
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.statements[key] += 1
+
+    def repeated(self, threshold):
+        with self._lock:
+            return [(sql, n) for sql, n in self.statements.most_common() if n >= threshold]
+
+
+_worker = threading.local()
+
+
+def current_tally():
+    tally = getattr(_worker, 'tally', None)
+    if tally is None and has_request_context():
+        tally = g.get('_query_tally')
+    return tally
+
+
+@contextlib.contextmanager
+def use_tally(tally):
+    # Lets a thread without the request context (see database.fan_out) count
+    # its statements against the request that started it
+    previous = getattr(_worker, 'tally', None)
+    _worker.tally = tally
+    try:
+        yield
+    finally:
+        _worker.tally = previous
+
+
+@on_query
+def _count_query(sql, seconds, caller):
+    tally = current_tally()
+    if tally is None or caller in IGNORED_CALLERS or caller.split('.', 1)[0] in IGNORED_MODULES:
+        return
+    tally.add(sql, seconds)
+
+
+################################################################################
+# Query budgets
+#   - Every request counts the statements it runs and the time they take,
+#     including those run for it by database.fan_out workers
+#   - @query_budget(n) on a view declares the most statements it should need;
+#     going over is logged as a warning, or raises QueryBudgetExceeded when
+#     [QUERY_BUDGET] strict = true or the app is in testing mode
+#   - The same statement (by fingerprint, so with any parameters) run
+#     [QUERY_BUDGET] repeat_threshold times (default 3) in one request is
+#     logged as a likely N+1 loop
+#   - With [QUERY_BUDGET] debug_headers (default: when app.debug is on) every
+#     response carries X-Query-Count, X-Query-Time-Ms and X-Query-Repeated
+#   - Streamed bodies run their queries after the response has been checked,
+#     so those are not counted
+################################################################################
+
+def query_budget(limit):
+    def decorator(view):
+        # Decorators above this one copy it across with functools.wraps
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def init_query_budget(app):
+    config = get_config()
+    repeat_threshold = config.getint('QUERY_BUDGET', 'repeat_threshold', fallback=3)
+    debug_headers = config.getboolean('QUERY_BUDGET', 'debug_headers', fallback=app.debug)
+    strict = config.getboolean('QUERY_BUDGET', 'strict', fallback=False)
+
+    @app.before_request
+    def start_query_tally():
+        g._query_tally = QueryTally()
+
+    @app.after_request
+    def check_query_budget(response):
+        tally = g.get('_query_tally')
+        if tally is None:
+            return response
+
+        repeated = tally.repeated(repeat_threshold)
+        for sql, times in repeated:
+            logging.warning(f"{request.endpoint} ran the same statement {times} times (N+1?): {sql}")
+
+        if debug_headers:
+            response.headers['X-Query-Count'] = str(tally.count)
+            response.headers['X-Query-Time-Ms'] = f"{tally.seconds * 1000.0:.1f}"
+            response.headers['X-Query-Repeated'] = str(len(repeated))
+
+        view = current_app.view_functions.get(request.endpoint)
+        limit = getattr(view, 'query_budget', None)
+        if limit is not None and tally.count > limit:
+            message = f"{request.endpoint} ran {tally.count} queries, over its budget of {limit}"
+            if strict or current_app.testing:
+                raise QueryBudgetExceeded(message)
+            logging.warning(message)
+        return response
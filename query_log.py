@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# Imports
+import atexit
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+
+from app_config import get_config, on_config_reload
+from metrics import DB_ERRORS, DB_SECONDS
+
+#  Sampled, structured query log
+##     fingerprint(sql)
+##     record_query(sql, seconds, rows, error)
+##     on_query(listener)
+##     query_log_stats()
+
+# Functions that only pass a query along; the caller we report is the first
+# function above them (e.g. list_users rather than rowfetchall)
+QUERY_HELPERS = {
+    'execute', 'executemany', 'run', 'dictfetchall', 'dictfetchone', 'rowfetchall', 'rowfetchone',
+    'execute_prepared', 'dictfetchprepared', 'dictfetchstream', 'fetch_summary', 'record_query',
+    '_insert_users', '_is_healthy', '_caller',
+}
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|(?<!:):[A-Za-z_]\w*|\$\d+")
+_REPEATED_VALUES = re.compile(r"(VALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """ The statement with literals and placeholders replaced by ?, so every
+        run of the same query groups together and no values are logged."""
+    text = _STRING_LITERAL.sub('?', sql)
+    text = _PLACEHOLDER.sub('?', text)
+    text = _NUMBER.sub('?', text)
+    text = _WHITESPACE.sub(' ', text).strip()
+    # Multi-row VALUES lists collapse to their first tuple
+    return _REPEATED_VALUES.sub(r"\1, ...", text)
+
+
+class _JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname}
+        entry.update(record.query)
+        return json.dumps(entry)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ Never blocks the request: when the queue is full the entry is dropped,
+        and formatting happens on the listener thread, not here."""
+
+    dropped = 0
+    _dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def prepare(self, record):
+        return record
+
+
+################################################################################
+# Query log
+#   - database.py calls record_query() after every statement with its time
+#     and row count; every statement also goes into the db_query_duration
+#     histogram in metrics.py, sampled or not
+#   - Statements slower than [QUERY_LOG] slow_ms (default 100) are always
+#     logged at WARNING; the rest at INFO with probability sample_rate
+#     (default 0.01)
+#   - Entries are JSON lines with the fingerprint, duration, row count and
+#     calling function, written to [QUERY_LOG] file (default stderr) by a
+#     background thread fed through a bounded queue
+################################################################################
+
+class _Settings:
+    def __init__(self, config):
+        self.enabled = config.getboolean('QUERY_LOG', 'enabled', fallback=True)
+        self.sample_rate = config.getfloat('QUERY_LOG', 'sample_rate', fallback=0.01)
+        self.slow_seconds = config.getfloat('QUERY_LOG', 'slow_ms', fallback=100.0) / 1000.0
+        self.path = config.get('QUERY_LOG', 'file', fallback=None)
+        self.queue_size = config.getint('QUERY_LOG', 'queue_size', fallback=10000)
+
+
+_settings = _Settings(get_config())
+_logger = logging.getLogger('airline.queries')
+_logger.propagate = False
+_logger.setLevel(logging.INFO)
+
+_target = logging.FileHandler(_settings.path) if _settings.path else logging.StreamHandler(sys.stderr)
+_target.setFormatter(_JSONFormatter())
+_handler = _DroppingQueueHandler(queue.Queue(maxsize=_settings.queue_size))
+_logger.addHandler(_handler)
+_listener = logging.handlers.QueueListener(_handler.queue, _target)
+_listener.start()
+atexit.register(_listener.stop)
+
+# Updated from request threads and fan_out workers at once
+_counts = {'queries': 0, 'slow': 0, 'logged': 0}
+_counts_lock = threading.Lock()
+
+@on_config_reload
+def _reload_settings(old_config, new_config):
+    # Sampling and the slow threshold apply straight away; a new file or
+    # queue size needs a restart
+    global _settings
+    _settings = _Settings(new_config)
+
+
+# listener(sql, seconds, caller), called for every statement; used to count
+# each request's queries (see query_budget.py)
+_query_listeners = []
+
+def on_query(listener):
+    _query_listeners.append(listener)
+    return listener
+
+
+def record_query(sql, seconds, rows, error=False):
+    caller = _caller()
+    DB_SECONDS.labels(caller).observe(seconds)
+    if error:
+        DB_ERRORS.labels(caller).inc()
+    for listener in _query_listeners:
+        try:
+            listener(sql, seconds, caller)
+        except Exception as e:
+            logging.error(f"Error in query listener: {e}")
+
+    settings = _settings
+    if not settings.enabled:
+        return
+    slow = seconds >= settings.slow_seconds
+    logged = slow or random.random() < settings.sample_rate
+    with _counts_lock:
+        _counts['queries'] += 1
+        _counts['slow'] += slow
+        _counts['logged'] += logged
+    if not logged:
+        return
+
+    query = {
+        'fingerprint': fingerprint(sql),
+        'ms': round(seconds * 1000.0, 3),
+        'rows': rows,
+        'caller': caller,
+        'slow': slow,
+        'error': error,
+    }
+    _logger.log(logging.WARNING if slow else logging.INFO, 'query', extra={'query': query})
+
+
+def query_log_stats():
+    with _counts_lock:
+        counts = dict(_counts)
+    return dict(counts, dropped=_handler.dropped, sample_rate=_settings.sample_rate,
+                slow_ms=_settings.slow_seconds * 1000.0)
+
+
+def _caller():
+    frame = sys._getframe(1)
+    while frame is not None:
+        name = frame.f_code.co_name
+        if name not in QUERY_HELPERS and frame.f_globals.get('__name__') != __name__:
+            module = frame.f_globals.get('__name__', '?')
+            return f"{module}.{name}"
+        frame = frame.f_back
+    return '?'
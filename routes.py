@@ -2,8 +2,19 @@
 
 from flask import *
 import database
-import configparser
 import os
+from app_config import get_config
+from pagination import page_args, keyset_page
+from streaming import wants_stream, stream_page
+from table_export import export_response
+from password_hashing import HashQueueFull
+from http_caching import conditional_get
+from page_cache import cached_page
+from query_budget import query_budget, init_query_budget
+from static_assets import init_static_assets
+from compression import init_compression
+from metrics import init_metrics
+from profiler import init_profiler
 
 from aircraft_routes import aircraft_bp
 
@@ -21,8 +32,7 @@ app.debug = True
 
 
 # Read my unikey to show me a personalised app
-config = configparser.ConfigParser()
-config.read('config.ini')
+config = get_config()
 print(config.sections())  # This should output ['DATABASE', 'FLASK']
 dbuser = config['DATABASE']['user']
 portchoice = config['FLASK']['port']
@@ -30,9 +40,20 @@ if portchoice == '10000':
     print('ERROR: Please change config.ini as in the comments or Lab instructions')
     exit(0)
 
+# Request, template and database timings at /metrics; set up first so the
+# timings cover every other hook, including the commit at the end
+init_metrics(app)
+
+# Opt-in request profiling ([PROFILER] in config.ini), listed at /profiles
+init_profiler(app)
+
 # Set up default session values before handling any requests
 @app.before_request
 def set_default_session_values():
+    # Static files never look at the session; touching it would add a cookie
+    # and Vary: Cookie to responses that should be cached by anyone
+    if request.endpoint in ('static', 'assets'):
+        return
     # Ensure certain keys always exist in the session for proper flow
     if 'logged_in' not in session:
         session['logged_in'] = False
@@ -41,6 +62,20 @@ def set_default_session_values():
 
 app.register_blueprint(aircraft_bp)
 
+# Share one database connection and transaction per request
+database.init_request_scope(app)
+
+# Count each request's queries; X-Query-Count headers and budget warnings.
+# Set up after the request scope so the budget is checked before the commit,
+# and going over it in strict mode rolls the request back
+init_query_budget(app)
+
+# Fingerprinted, precompressed static files (python manage.py build-static)
+init_static_assets(app)
+
+# gzip pages and JSON on the way out
+init_compression(app)
+
 ###########################################################################################
 ###########################################################################################
 ####                                 Database operative routes                         ####
@@ -81,8 +116,6 @@ def login():
     if(request.method == 'POST'):
         # Get our login value
         val = database.check_login(request.form['userid'], request.form['password'])
-        print(val)
-        print(request.form)
         # If our database connection gave back an error
         if(val == None):
             errortext = "Error with the database connection."
@@ -97,7 +130,6 @@ def login():
             return redirect(url_for('login'))
 
         # If it was successful, then we can log them in :)
-        print(val[0])
         session['name'] = val[0]['firstname']
         session['userid'] = request.form['userid']
         session['logged_in'] = True
@@ -127,14 +159,20 @@ def logout():
 ########################
 
 @app.route('/users')
+@conditional_get('users')
+@query_budget(2)
 def list_users():
     '''
     List all rows in users by calling the relvant database calls and pushing to the appropriate template
     '''
-    print("Printing session!!")
-    print(session)
-    # connect to the database and call the relevant function
-    users_listdict = database.list_users()
+    # Admins can ask for every row, streamed as it is read
+    if wants_stream():
+        page['title'] = 'List Contents of users'
+        return stream_page('list_users.html', page=page, session=session, users=database.stream_users(), pager=None)
+
+    # connect to the database and call the relevant function, one page at a time
+    after, before, limit = page_args()
+    users_listdict, pager = keyset_page(database.list_users, 'userid', after, before, limit)
 
     # Handle the null condition
     if (users_listdict is None):
@@ -142,15 +180,24 @@ def list_users():
         users_listdict = []
         flash('Error, there are no rows in users', 'danger')
     page['title'] = 'List Contents of users'
-    return render_template('list_users.html', page=page, session=session, users=users_listdict)
+    return render_template('list_users.html', page=page, session=session, users=users_listdict, pager=pager)
     
 
+@app.route('/users/export.<fmt>')
+def export_users(fmt):
+    '''
+    Stream every user (without passwords) as CSV or NDJSON for the nightly export
+    '''
+    return export_response('users', fmt)
+
+
 ########################
 #List Single Items#
 ########################
 
 
 @app.route('/users/<userid>')
+@query_budget(1)
 def list_single_users(userid):
     '''
     List all rows in users that match a particular id attribute userid by calling the 
@@ -175,13 +222,21 @@ def list_single_users(userid):
 ########################
 
 @app.route('/consolidated/users')
+@conditional_get('users', 'userroles')
+@query_budget(2)
 def list_consolidated_users():
     '''
     List all rows in users join userroles 
     by calling the relvant database calls and pushing to the appropriate template
     '''
-    # connect to the database and call the relevant function
-    users_userroles_listdict = database.list_consolidated_users()
+    # Admins can ask for every row, streamed as it is read
+    if wants_stream():
+        page['title'] = 'List Contents of Users join Userroles'
+        return stream_page('list_consolidated_users.html', page=page, session=session, users=database.stream_consolidated_users(), pager=None)
+
+    # connect to the database and call the relevant function, one page at a time
+    after, before, limit = page_args()
+    users_userroles_listdict, pager = keyset_page(database.list_consolidated_users, 'userid', after, before, limit)
 
     # Handle the null condition
     if (users_userroles_listdict is None):
@@ -189,9 +244,11 @@ def list_consolidated_users():
         users_userroles_listdict = []
         flash('Error, there are no rows in users_userroles_listdict', 'danger')
     page['title'] = 'List Contents of Users join Userroles'
-    return render_template('list_consolidated_users.html', page=page, session=session, users=users_userroles_listdict)
+    return render_template('list_consolidated_users.html', page=page, session=session, users=users_userroles_listdict, pager=pager)
 
 @app.route('/user_stats')
+@cached_page('users', 'userroles')
+@query_budget(1)
 def list_user_stats():
     '''
     List some user stats
@@ -217,15 +274,21 @@ def search_users_byname():
         # Extract search field and term
         search_field = request.form.get('searchfield', '').strip()
         search_term = request.form.get('searchterm', '').strip()
+        # Substring unless the regex (or another) mode is asked for explicitly
+        search_mode = request.form.get('searchmode', 'substring').strip()
 
         # Validate inputs
         if not search_field or not search_term:
             flash('Both search field and search term are required.', 'danger')
             return render_template('search_users.html', page=page, session=session)
+        if search_mode not in database.SEARCH_MODES:
+            flash(f'Unknown search mode: {search_mode}', 'danger')
+            return render_template('search_users.html', page=page, session=session)
 
         try:
-            # Perform database search
-            search = database.search_users_customfilter(search_field, "~", search_term)
+            # Perform database search, asking for one extra row to spot a cut-off
+            limit = database.SEARCH_RESULT_LIMIT
+            search = database.search_users(search_field.lower(), search_mode, search_term, limit=limit + 1)
             
             # Handle invalid search term (no results found)
             if search is None or len(search) == 0:
@@ -233,7 +296,9 @@ def search_users_byname():
                 return render_template('search_users.html', page=page, session=session)
 
             # If search is successful, pass the results to the template
-            users_listdict = search
+            users_listdict = search[:limit]
+            if len(search) > limit:
+                flash(f'Showing the first {limit} matches, narrow the search to see the rest.', 'info')
             page['title'] = f'Users matching search: {search_term}'
             return render_template('list_users.html', page=page, session=session, users=users_listdict)
         
@@ -274,9 +339,7 @@ def update_user():
 
     userslist = None
 
-    print("request form is:")
     newdict = {}
-    print(request.form)
 
     validupdate = False
     # Check your incoming parameters
@@ -289,38 +352,31 @@ def update_user():
             return redirect(url_for('list_users'))
         else:
             newdict['userid'] = request.form['userid']
-            print("We have a value: ",newdict['userid'])
 
         if ('firstname' not in request.form):
             newdict['firstname'] = None
         else:
             validupdate = True
             newdict['firstname'] = request.form['firstname']
-            print("We have a value: ",newdict['firstname'])
 
         if ('lastname' not in request.form):
             newdict['lastname'] = None
         else:
             validupdate = True
             newdict['lastname'] = request.form['lastname']
-            print("We have a value: ",newdict['lastname'])
 
         if ('userroleid' not in request.form):
             newdict['userroleid'] = None
         else:
             validupdate = True
             newdict['userroleid'] = request.form['userroleid']
-            print("We have a value: ",newdict['userroleid'])
 
         if ('password' not in request.form):
             newdict['password'] = None
         else:
             validupdate = True
             newdict['password'] = request.form['password']
-            print("We have a value: ",newdict['password'])
 
-        print('Update dict is:')
-        print(newdict, validupdate)
 
         if validupdate:
             #forward to the database to manage update
@@ -338,6 +394,9 @@ def update_user():
 ## Edit user
 ######
 @app.route('/users/edit/<userid>', methods=['POST','GET'])
+# GET: the user and the role list; POST: the user, the UPDATE, then the
+# user again for the page shown afterwards
+@query_budget(3)
 def edit_user(userid):
     """
     Edit a user
@@ -351,7 +410,14 @@ def edit_user(userid):
     page['title'] = 'Edit user details'
 
     users_listdict = None
-    users_listdict = database.list_users_equifilter("userid", userid)
+    userroles = None
+    if request.method == 'POST':
+        users_listdict = database.list_users_equifilter("userid", userid)
+    else:
+        # The user and the role list do not depend on each other, fetch them side by side
+        users_listdict, userroles = database.fan_out(
+            (database.list_users_equifilter, "userid", userid),
+            (database.list_userroles,))
 
     # Handle the null condition
     if (users_listdict is None or len(users_listdict) == 0):
@@ -360,9 +426,7 @@ def edit_user(userid):
         flash('Error, there are no rows in users that match the attribute "userid" for the value '+userid, 'danger')
 
     userslist = None
-    print("request form is:")
     newdict = {}
-    print(request.form)
     user = users_listdict[0]
     validupdate = False
 
@@ -376,38 +440,31 @@ def edit_user(userid):
             return redirect(url_for('list_users'))
         else:
             newdict['userid'] = request.form['userid']
-            print("We have a value: ",newdict['userid'])
 
         if ('firstname' not in request.form):
             newdict['firstname'] = None
         else:
             validupdate = True
             newdict['firstname'] = request.form['firstname']
-            print("We have a value: ",newdict['firstname'])
 
         if ('lastname' not in request.form):
             newdict['lastname'] = None
         else:
             validupdate = True
             newdict['lastname'] = request.form['lastname']
-            print("We have a value: ",newdict['lastname'])
 
         if ('userroleid' not in request.form):
             newdict['userroleid'] = None
         else:
             validupdate = True
             newdict['userroleid'] = request.form['userroleid']
-            print("We have a value: ",newdict['userroleid'])
 
         if ('password' not in request.form):
             newdict['password'] = None
         else:
             validupdate = True
             newdict['password'] = request.form['password']
-            print("We have a value: ",newdict['password'])
 
-        print('Update dict is:')
-        print(newdict, validupdate)
 
         if validupdate:
             #forward to the database to manage update
@@ -423,7 +480,7 @@ def edit_user(userid):
         return render_template('edit_user.html',
                            session=session,
                            page=page,
-                           userroles=database.list_userroles(),
+                           userroles=userroles,
                            user=user)
 
 
@@ -446,9 +503,7 @@ def add_user():
     page['title'] = 'Add user details'
 
     userslist = None
-    print("request form is:")
     newdict = {}
-    print(request.form)
 
     # Check your incoming parameters
     if(request.method == 'POST'):
@@ -460,38 +515,30 @@ def add_user():
             return redirect(url_for('add_user'))
         else:
             newdict['userid'] = request.form['userid']
-            print("We have a value: ",newdict['userid'])
 
         if ('firstname' not in request.form):
             newdict['firstname'] = 'Empty firstname'
         else:
             newdict['firstname'] = request.form['firstname']
-            print("We have a value: ",newdict['firstname'])
 
         if ('lastname' not in request.form):
             newdict['lastname'] = 'Empty lastname'
         else:
             newdict['lastname'] = request.form['lastname']
-            print("We have a value: ",newdict['lastname'])
 
         if ('userroleid' not in request.form):
             newdict['userroleid'] = 1 # default is traveler
         else:
             newdict['userroleid'] = request.form['userroleid']
-            print("We have a value: ",newdict['userroleid'])
 
         if ('password' not in request.form):
             newdict['password'] = 'blank'
         else:
             newdict['password'] = request.form['password']
-            print("We have a value: ",newdict['password'])
 
-        print('Insert parametesrs are:')
-        print(newdict)
 
         database.add_user_insert(newdict['userid'], newdict['firstname'],newdict['lastname'],newdict['userroleid'],newdict['password'])
         # Should redirect to your newly updated user
-        print("did it go wrong here?")
         return redirect(url_for('list_consolidated_users'))
     else:
         # assuming GET request, need to setup for this
@@ -499,3 +546,37 @@ def add_user():
                            session=session,
                            page=page,
                            userroles=database.list_userroles())
+
+
+# Most users accepted by one /users/batch request
+MAX_BATCH_USERS = 10000
+
+@app.route('/users/batch', methods=['POST'])
+def add_users_batch():
+    """
+    Add many users from a JSON list (or {"users": [...]}) of
+    {"userid", "firstname", "lastname", "userroleid", "password"} objects.
+    Responds with the userids added and every rejected row with its reason.
+    """
+    if not session.get('isadmin'):
+        return jsonify({'error': 'Only admins can add users in bulk'}), 403
+
+    users = request.get_json(silent=True)
+    if isinstance(users, dict):
+        users = users.get('users')
+    if not isinstance(users, list):
+        return jsonify({'error': 'Expected a JSON list of users'}), 400
+    if len(users) > MAX_BATCH_USERS:
+        return jsonify({'error': f'At most {MAX_BATCH_USERS} users per batch'}), 413
+
+    try:
+        result = database.add_users_batch(users)
+    except HashQueueFull as e:
+        return jsonify({'error': f'Too busy hashing passwords, try again shortly ({e})'}), 503
+    if result is None:
+        return jsonify({'error': 'Could not connect to the database'}), 500
+
+    return jsonify({'inserted': len(result['inserted']),
+                    'rejected': len(result['rejected']),
+                    'userids': result['inserted'],
+                    'errors': result['rejected']})
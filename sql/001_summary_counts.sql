@@ -0,0 +1,131 @@
+-- Summary tables behind /user_stats and /aircraft_summary
+--   - user_role_counts holds the number of users per userroleid
+--   - aircraft_manufacturer_counts holds the number of aircraft per manufacturer
+--   - Row triggers on users and aircraft keep both up to date, so the report
+--     pages read one row per group instead of scanning the whole table;
+--     TRUNCATE on either table empties its summary
+--   - rebuild_summary_counts() recounts everything from scratch; run it with
+--     python manage.py reconcile-summaries
+-- Safe to run more than once
+
+SET search_path TO airline;
+
+CREATE TABLE IF NOT EXISTS user_role_counts (
+    userroleid  BIGINT PRIMARY KEY,
+    count       BIGINT NOT NULL DEFAULT 0
+);
+
+-- A NULL manufacturer has its own row, apart from an empty one: a primary
+-- key can not hold NULL, so the unique index tells the two apart instead
+CREATE TABLE IF NOT EXISTS aircraft_manufacturer_counts (
+    manufacturer    VARCHAR(100),
+    total_aircraft  BIGINT NOT NULL DEFAULT 0
+);
+
+-- Tables created by an earlier version of this file keyed NULL as ''
+ALTER TABLE aircraft_manufacturer_counts DROP CONSTRAINT IF EXISTS aircraft_manufacturer_counts_pkey;
+ALTER TABLE aircraft_manufacturer_counts ALTER COLUMN manufacturer DROP NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS aircraft_manufacturer_counts_key
+    ON aircraft_manufacturer_counts ((COALESCE(manufacturer, '')), (manufacturer IS NULL));
+
+
+CREATE OR REPLACE FUNCTION user_role_counts_maintain() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.userroleid IS NOT NULL THEN
+        UPDATE user_role_counts SET count = count - 1 WHERE userroleid = OLD.userroleid;
+        DELETE FROM user_role_counts WHERE userroleid = OLD.userroleid AND count <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.userroleid IS NOT NULL THEN
+        INSERT INTO user_role_counts AS c (userroleid, count) VALUES (NEW.userroleid, 1)
+            ON CONFLICT (userroleid) DO UPDATE SET count = c.count + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_role_counts_insert_delete ON users;
+CREATE TRIGGER user_role_counts_insert_delete
+    AFTER INSERT OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION user_role_counts_maintain();
+
+DROP TRIGGER IF EXISTS user_role_counts_update ON users;
+CREATE TRIGGER user_role_counts_update
+    AFTER UPDATE OF userroleid ON users
+    FOR EACH ROW WHEN (OLD.userroleid IS DISTINCT FROM NEW.userroleid)
+    EXECUTE FUNCTION user_role_counts_maintain();
+
+
+CREATE OR REPLACE FUNCTION aircraft_manufacturer_counts_maintain() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE aircraft_manufacturer_counts SET total_aircraft = total_aircraft - 1
+            WHERE manufacturer IS NOT DISTINCT FROM OLD.manufacturer;
+        DELETE FROM aircraft_manufacturer_counts
+            WHERE manufacturer IS NOT DISTINCT FROM OLD.manufacturer AND total_aircraft <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO aircraft_manufacturer_counts AS c (manufacturer, total_aircraft)
+            VALUES (NEW.manufacturer, 1)
+            ON CONFLICT ((COALESCE(manufacturer, '')), (manufacturer IS NULL))
+            DO UPDATE SET total_aircraft = c.total_aircraft + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS aircraft_manufacturer_counts_insert_delete ON aircraft;
+CREATE TRIGGER aircraft_manufacturer_counts_insert_delete
+    AFTER INSERT OR DELETE ON aircraft
+    FOR EACH ROW EXECUTE FUNCTION aircraft_manufacturer_counts_maintain();
+
+DROP TRIGGER IF EXISTS aircraft_manufacturer_counts_update ON aircraft;
+CREATE TRIGGER aircraft_manufacturer_counts_update
+    AFTER UPDATE OF manufacturer ON aircraft
+    FOR EACH ROW WHEN (OLD.manufacturer IS DISTINCT FROM NEW.manufacturer)
+    EXECUTE FUNCTION aircraft_manufacturer_counts_maintain();
+
+
+-- TRUNCATE fires no row triggers, so empty the matching summary here
+CREATE OR REPLACE FUNCTION summary_counts_truncate() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'users' THEN
+        DELETE FROM user_role_counts;
+    ELSE
+        DELETE FROM aircraft_manufacturer_counts;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_role_counts_truncate ON users;
+CREATE TRIGGER user_role_counts_truncate
+    AFTER TRUNCATE ON users
+    FOR EACH STATEMENT EXECUTE FUNCTION summary_counts_truncate();
+
+DROP TRIGGER IF EXISTS aircraft_manufacturer_counts_truncate ON aircraft;
+CREATE TRIGGER aircraft_manufacturer_counts_truncate
+    AFTER TRUNCATE ON aircraft
+    FOR EACH STATEMENT EXECUTE FUNCTION summary_counts_truncate();
+
+
+-- Recount both summaries from the base tables
+-- SHARE locks block writers (and so the triggers) while we rebuild
+CREATE OR REPLACE FUNCTION rebuild_summary_counts() RETURNS void AS $$
+BEGIN
+    LOCK TABLE users, aircraft IN SHARE MODE;
+
+    DELETE FROM user_role_counts;
+    INSERT INTO user_role_counts (userroleid, count)
+        SELECT userroleid, COUNT(*) FROM users
+        WHERE userroleid IS NOT NULL
+        GROUP BY userroleid;
+
+    DELETE FROM aircraft_manufacturer_counts;
+    INSERT INTO aircraft_manufacturer_counts (manufacturer, total_aircraft)
+        SELECT manufacturer, COUNT(*) FROM aircraft
+        GROUP BY manufacturer;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_summary_counts();
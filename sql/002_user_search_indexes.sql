@@ -0,0 +1,22 @@
+-- Indexes behind /users/search (database.search_users)
+--   - Trigram GIN indexes on lower(firstname), lower(lastname) and
+--     lower(userid) serve substring searches (LIKE '%term%') and the opt-in
+--     regex mode (~), instead of running the pattern against every row
+--   - text_pattern_ops btree indexes on the same expressions serve exact
+--     (=) and prefix (LIKE 'term%') searches, which is cheaper than trigrams
+--     and also works for terms shorter than three characters
+-- Safe to run more than once
+
+SET search_path TO airline;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS users_firstname_trgm_idx ON users USING gin (lower(firstname) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS users_lastname_trgm_idx ON users USING gin (lower(lastname) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS users_userid_trgm_idx ON users USING gin (lower(userid) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS users_firstname_pattern_idx ON users (lower(firstname) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS users_lastname_pattern_idx ON users (lower(lastname) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS users_userid_pattern_idx ON users (lower(userid) text_pattern_ops);
+
+ANALYZE users;
@@ -0,0 +1,63 @@
+-- Per-table version numbers behind the ETags of the list and detail pages
+--   - A statement trigger appends a row to table_changes whenever a tracked
+--     table is written to; a table's version is its newest change_id
+--   - Appending never touches a row another transaction holds, so writers
+--     to the same table do not queue behind each other for the whole
+--     request, and requests writing several tables can not deadlock here
+--   - The new row only becomes visible when the write commits, together
+--     with the data it stands for
+--   - Every 1000th change also deletes the rows that are no longer the newest
+--     for their table, unless another transaction is already doing so
+--   - http_caching.py reads them to decide whether a page can still be
+--     answered with 304 Not Modified
+--   - changed_at keeps ETags from repeating if the database is rebuilt and
+--     the counters start again from zero
+-- Safe to run more than once
+
+SET search_path TO airline;
+
+CREATE TABLE IF NOT EXISTS table_changes (
+    change_id   BIGSERIAL PRIMARY KEY,
+    table_name  TEXT NOT NULL,
+    changed_at  TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE INDEX IF NOT EXISTS table_changes_latest ON table_changes (table_name, change_id);
+
+INSERT INTO table_changes (table_name)
+    SELECT name FROM unnest(ARRAY['users', 'userroles', 'aircraft']) AS name
+    WHERE NOT EXISTS (SELECT 1 FROM table_changes WHERE table_name = name);
+
+-- The single row per table this replaced; every writer had to lock it
+DROP TABLE IF EXISTS table_versions;
+
+
+CREATE OR REPLACE FUNCTION table_versions_bump() RETURNS trigger AS $$
+DECLARE
+    latest BIGINT;
+BEGIN
+    INSERT INTO table_changes (table_name) VALUES (TG_TABLE_NAME)
+        RETURNING change_id INTO latest;
+    IF latest % 1000 = 0 AND pg_try_advisory_xact_lock(2120003) THEN
+        DELETE FROM table_changes old
+            WHERE change_id < (SELECT max(change_id) FROM table_changes newest
+                               WHERE newest.table_name = old.table_name);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_version_bump ON users;
+CREATE TRIGGER users_version_bump
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON users
+    FOR EACH STATEMENT EXECUTE FUNCTION table_versions_bump();
+
+DROP TRIGGER IF EXISTS userroles_version_bump ON userroles;
+CREATE TRIGGER userroles_version_bump
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON userroles
+    FOR EACH STATEMENT EXECUTE FUNCTION table_versions_bump();
+
+DROP TRIGGER IF EXISTS aircraft_version_bump ON aircraft;
+CREATE TRIGGER aircraft_version_bump
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON aircraft
+    FOR EACH STATEMENT EXECUTE FUNCTION table_versions_bump();
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Imports
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import abort, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+# brotli is optional; without it only .gz siblings are written
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#  Fingerprinted, precompressed static files
+##     build_static(source, dest)      -> manifest dict
+##     init_static_assets(app)
+##     asset_url(filename)             (template global)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_NAME = 'manifest.json'
+
+# Fingerprinted names never change content, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Only text files are worth compressing
+COMPRESS_EXTENSIONS = {'.css', '.js', '.map', '.json', '.svg', '.txt', '.html'}
+
+# Hex digits of the content hash put into each file name
+HASH_LENGTH = 12
+
+
+################################################################################
+# Build step (python manage.py build-static)
+#   - Copies every file under static/ to static/dist/ with a content hash in
+#     its name, e.g. css/bootstrap.css -> css/bootstrap.3f2a9c1e0b7d.css
+#   - Writes .gz (and .br when brotli is installed) next to each text file
+#     if that makes it smaller
+#   - Source maps are also copied under their own names, since the minified
+#     files point at them by name
+#   - manifest.json maps the original names to the fingerprinted ones;
+#     files from earlier builds are left alone for pages still using them
+################################################################################
+
+def build_static(source=STATIC_DIR, dest=DIST_DIR):
+    manifest = {}
+    for root, dirs, files in os.walk(source):
+        # Never fingerprint our own output
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dest]
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, source).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            stem, ext = os.path.splitext(relative)
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+            hashed = f"{stem}.{digest}{ext}"
+            manifest[relative] = hashed
+
+            targets = [hashed, relative] if ext == '.map' else [hashed]
+            for target in targets:
+                _write_asset(os.path.join(dest, target), data, ext in COMPRESS_EXTENSIONS)
+
+    os.makedirs(dest, exist_ok=True)
+    temporary = os.path.join(dest, MANIFEST_NAME + '.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temporary, os.path.join(dest, MANIFEST_NAME))
+    return manifest
+
+
+def _write_asset(path, data, compress):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if not compress:
+        return
+
+    # mtime=0 keeps the .gz identical from one build to the next
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+################################################################################
+# Serving
+#   - asset_url('css/bootstrap.css') gives the fingerprinted /assets/... URL
+#     once build-static has been run, and the plain /static/... URL before
+#   - /assets/<filename> sends the .br or .gz sibling when the browser takes
+#     it, with far-future immutable caching
+#   - The manifest is read when the app starts; restart after a new build
+################################################################################
+
+_manifest = {}
+
+def init_static_assets(app):
+    global _manifest
+    try:
+        with open(os.path.join(DIST_DIR, MANIFEST_NAME)) as f:
+            _manifest = json.load(f)
+    except FileNotFoundError:
+        print("static/dist has not been built, serving plain static files. Run: python manage.py build-static")
+        _manifest = {}
+
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+    app.add_template_global(asset_url)
+
+
+def asset_url(filename):
+    hashed = _manifest.get(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('assets', filename=hashed)
+
+
+def serve_asset(filename):
+    if safe_join(DIST_DIR, filename) is None:
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.isfile(os.path.join(DIST_DIR, filename + suffix)):
+            encoding = candidate
+            filename += suffix
+            break
+
+    if not os.path.isfile(os.path.join(DIST_DIR, filename)):
+        abort(404)
+    response = send_from_directory(DIST_DIR, filename, mimetype=mimetype, max_age=31536000)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# Imports
+from flask import Response, current_app, request, session, stream_with_context
+
+#  Streamed HTML pages
+##     wants_stream()
+##     stream_page(template_name, **context)
+
+# How many template output chunks Jinja collects before each write
+STREAM_BUFFER_SIZE = 64
+
+
+def wants_stream():
+    """ True when an admin asked for the whole list with ?stream=1."""
+    return request.args.get('stream') == '1' and session.get('isadmin') == True
+
+
+def stream_page(template_name, **context):
+    """ Renders a template as it is iterated, instead of building one big string.
+        Any generator in the context (see database.dictfetchstream) is consumed
+        while the response is being sent, inside the request context."""
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    return Response(stream_with_context(stream), mimetype='text/html')
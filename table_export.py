@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Imports
+import queue
+import threading
+import zlib
+
+from flask import Response, abort, request, session
+
+import database
+
+#  Streamed table exports (/users/export.<fmt>, /aircrafts/export.<fmt>)
+##     export_response(table, fmt)
+
+# Bytes collected from COPY before they are handed to the response
+EXPORT_CHUNK_SIZE = 64 * 1024
+# Chunks that may wait for a slow client before COPY is made to wait too
+EXPORT_QUEUE_DEPTH = 8
+# How often a blocked COPY checks whether the client has gone away
+EXPORT_PUT_TIMEOUT = 1.0
+
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# Marks the end of the export in the chunk queue
+_DONE = object()
+
+
+class ExportCancelled(Exception):
+    """ The client went away, stop COPY."""
+
+
+################################################################################
+# Export response
+#   - COPY ... TO STDOUT runs on a worker thread with its own pooled
+#     connection and writes into a bounded queue; the response body reads from
+#     that queue, so at most EXPORT_QUEUE_DEPTH chunks are ever held
+#   - ?columns=a,b picks and orders the columns (see database.EXPORT_COLUMNS)
+#   - ?gzip=1 sends a .gz file compressed on the fly
+#   - Only admins may export
+################################################################################
+
+def export_response(table, fmt):
+    if not session.get('isadmin'):
+        abort(403)
+    if fmt not in database.EXPORT_FORMATS:
+        abort(404)
+
+    allowed = database.EXPORT_COLUMNS[table]
+    columns = request.args.get('columns')
+    columns = [c.strip().lower() for c in columns.split(',') if c.strip()] if columns else allowed
+    unknown = [c for c in columns if c not in allowed]
+    if unknown or not columns:
+        abort(400, f"Unknown column(s) {', '.join(unknown) or '(none)'}; choose from {', '.join(allowed)}")
+
+    body = _copy_chunks(table, columns, fmt)
+    filename = f"{table}.{fmt}"
+    mimetype = MIMETYPES[fmt]
+    if request.args.get('gzip') == '1':
+        body = _gzip_chunks(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+######################################
+# Internal helpers
+######################################
+
+class _QueueWriter:
+    """ The stream COPY writes to: gathers rows into chunks for the queue."""
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= EXPORT_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                self.chunks.put(item, timeout=EXPORT_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+
+def _copy_chunks(table, columns, fmt):
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_DEPTH)
+    cancelled = threading.Event()
+    writer = _QueueWriter(chunks, cancelled)
+
+    def run_copy():
+        try:
+            if database.copy_export(table, columns, fmt, writer) is None:
+                raise ConnectionError("Could not connect to the database")
+            writer.flush()
+            writer.put(_DONE)
+        except ExportCancelled:
+            pass
+        except Exception as e:
+            try:
+                writer.put(e)
+            except ExportCancelled:
+                pass
+
+    thread = threading.Thread(target=run_copy, name=f"export-{table}", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                # Headers are already sent, so all we can do is cut the
+                # response short; the client sees an incomplete transfer
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Tests for the in-process LRU cache (entity_cache.py)
+#
+#   python -m pytest tests
+
+# Imports
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from entity_cache import LRUCache, MISSING
+
+
+def test_put_after_invalidate_is_dropped():
+    # A reader misses, a writer invalidates while the reader is at the
+    # database, then the reader tries to cache the row it read
+    cache = LRUCache(maxsize=8, ttl=60.0)
+    generation = cache.generation()
+    cache.invalidate(1)
+    cache.put(1, 'stale row', generation)
+    assert cache.get(1) is MISSING
+
+
+def test_read_overtaken_by_invalidate_is_not_cached():
+    # The same race with a real reader and writer thread, the writer's
+    # invalidate landing between the reader's miss and its put
+    cache = LRUCache(maxsize=8, ttl=60.0)
+    read_started = threading.Event()
+    invalidated = threading.Event()
+
+    def reader():
+        assert cache.get(1) is MISSING
+        generation = cache.generation()
+        read_started.set()
+        invalidated.wait()
+        cache.put(1, 'stale row', generation)
+
+    def writer():
+        read_started.wait()
+        cache.invalidate(1)
+        invalidated.set()
+
+    threads = [threading.Thread(target=reader), threading.Thread(target=writer)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.get(1) is MISSING
+
+    # The next read starts after the invalidate, so it is cached
+    generation = cache.generation()
+    cache.put(1, 'fresh row', generation)
+    assert cache.get(1) == 'fresh row'
+
+
+def test_invalidating_another_key_does_not_drop_put():
+    cache = LRUCache(maxsize=8, ttl=60.0)
+    generation = cache.generation()
+    cache.invalidate(2)
+    cache.put(1, 'row', generation)
+    assert cache.get(1) == 'row'
+
+
+def test_forgotten_invalidation_drops_older_reads():
+    # Once more than maxsize keys have been invalidated the oldest is no
+    # longer remembered, so reads from before it are not trusted
+    cache = LRUCache(maxsize=2, ttl=60.0)
+    generation = cache.generation()
+    for key in (1, 2, 3):
+        cache.invalidate(key)
+    cache.put(1, 'stale row', generation)
+    assert cache.get(1) is MISSING
+
+
+def test_clear_drops_reads_from_before_it():
+    cache = LRUCache(maxsize=8, ttl=60.0)
+    generation = cache.generation()
+    cache.clear()
+    cache.put(1, 'stale row', generation)
+    assert cache.get(1) is MISSING
@@ -1,4 +1,8 @@
-from routes import *
+# Password hashing workers (see password_hashing.py) are started with spawn,
+# which runs this file again as __mp_main__; they only need bcrypt, so
+# don't build the whole app (and its DB connections and threads) in them
+if __name__ != '__mp_main__':
+    from routes import *
 
 # Starting the python applicaiton
 if __name__ == '__main__':